@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: overhead mỗi request của middleware đo HTTP cũ (@app.middleware("http"),
+BaseHTTPMiddleware + time.time() + path thật) so với MetricsMiddleware (ASGI thuần, perf_counter,
+route template). Gọi thẳng ASGI app, không qua network, để chỉ đo phần middleware
+
+Usage: python benchmarks/bench_middleware.py [so_request] [so_lan_lap]
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+from fastapi import FastAPI, Request
+from prometheus_client import Counter, Histogram
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../services/template'))
+from middleware import MetricsMiddleware
+
+
+def make_app(kind, name):
+    app = FastAPI()
+
+    @app.get("/orders/{order_id}")
+    async def get_order(order_id: str):
+        return {"orderId": order_id}
+
+    if kind == "legacy":
+        requests_total = Counter(f'{name}_http_requests_total', 'x', ['method', 'endpoint', 'status'])
+        duration_seconds = Histogram(f'{name}_http_request_duration_seconds', 'x', ['method', 'endpoint'])
+
+        # Giống track_requests trong main.py trước đây
+        @app.middleware("http")
+        async def track_requests(request: Request, call_next):
+            start_time = time.time()
+            response = await call_next(request)
+            duration = time.time() - start_time
+            method = request.method
+            endpoint = request.url.path
+            status = str(response.status_code)
+            requests_total.labels(method=method, endpoint=endpoint, status=status).inc()
+            duration_seconds.labels(method=method, endpoint=endpoint).observe(duration)
+            return response
+    elif kind == "asgi":
+        app.add_middleware(MetricsMiddleware, prefix=name)
+    return app
+
+
+async def run(app, n, distinct=True):
+    start = time.perf_counter()
+    for i in range(n):
+        body_read = False
+        finished = asyncio.Event()
+
+        async def receive():
+            nonlocal body_read
+            if not body_read:
+                body_read = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            # Như một client thật: chỉ ngắt kết nối sau khi nhận hết response
+            await finished.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                finished.set()
+
+        # id khác nhau mỗi request: middleware cũ tạo một series mới cho mỗi id
+        path = f"/orders/{i}" if distinct else "/orders/1"
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+            "scheme": "http", "path": path, "raw_path": path.encode(),
+            "query_string": b"", "root_path": "", "headers": [], "client": ("127.0.0.1", 1), "server": ("bench", 80),
+        }
+        await app(scope, receive, send)
+    return time.perf_counter() - start
+
+
+VARIANTS = [
+    ("none", True, "no middleware:                        "),
+    ("legacy", True, "legacy  (BaseHTTPMiddleware, raw path):"),
+    ("legacy", False, "legacy  (same path every request):     "),
+    ("asgi", True, "asgi    (MetricsMiddleware, template): "),
+]
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    loop = asyncio.new_event_loop()
+    apps = [make_app(kind, f"bench_{kind}_{i}") for i, (kind, _, _) in enumerate(VARIANTS)]
+    for app, (_, distinct, _) in zip(apps, VARIANTS):
+        loop.run_until_complete(run(app, 100, distinct))  # warm up (dựng middleware stack)
+    # Chạy xen kẽ các biến thể ở mỗi vòng để nhiễu của máy chia đều
+    best = [float("inf")] * len(VARIANTS)
+    for _ in range(repeat):
+        for i, (app, (_, distinct, _)) in enumerate(zip(apps, VARIANTS)):
+            best[i] = min(best[i], loop.run_until_complete(run(app, n, distinct)))
+    loop.close()
+
+    per = lambda t: t / n * 1e6
+    print(f"requests: {n}, best of {repeat}")
+    for (_, _, label), t in zip(VARIANTS, best):
+        print(f"{label} {per(t):8.1f} us/request  overhead {per(t - best[0]):7.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: serialize list response theo cách cũ (rewrite _id + jsonable_encoder + json)
+so với BSONJSONResponse (orjson, encode BSON trực tiếp)
+
+Usage: python benchmarks/bench_serialization.py [so_document] [so_lan_lap]
+"""
+
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+from bson import Decimal128, ObjectId
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../services/template'))
+from serialization import BSONJSONResponse
+
+
+def make_docs(n):
+    base = datetime(2026, 1, 1)
+    return [
+        {
+            "_id": ObjectId(),
+            "orderId": f"ORD-{i:08d}",
+            "customerId": f"CUS-{i % 997:05d}",
+            "driverId": f"DRV-{i % 113:04d}",
+            "status": ("NEW", "ASSIGNED", "DELIVERED")[i % 3],
+            "pickupAddress": {"street": f"{i} Nguyen Trai", "city": "Ho Chi Minh"},
+            "totalAmount": Decimal128(f"{i % 500}.50"),
+            "createdAt": base + timedelta(minutes=i),
+            "updatedAt": base + timedelta(minutes=i, seconds=30),
+        }
+        for i in range(n)
+    ]
+
+
+def legacy_path(docs):
+    # Giống handler cũ: đổi _id từng document rồi để FastAPI encode
+    for d in docs:
+        if "_id" in d:
+            d["_id"] = str(d["_id"])
+    return JSONResponse(content=jsonable_encoder(docs, custom_encoder={Decimal128: str})).body
+
+
+def fast_path(docs):
+    return BSONJSONResponse(content={"items": docs, "next": None}).body
+
+
+def bench(fn, n, repeat):
+    best = float("inf")
+    size = 0
+    for _ in range(repeat):
+        docs = make_docs(n)
+        start = time.perf_counter()
+        size = len(fn(docs))
+        best = min(best, time.perf_counter() - start)
+    return best, size
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    legacy, legacy_size = bench(legacy_path, n, repeat)
+    fast, fast_size = bench(fast_path, n, repeat)
+
+    print(f"documents: {n}, best of {repeat}")
+    print(f"legacy  (_id rewrite + jsonable_encoder + json): {legacy * 1000:8.2f} ms  {n / legacy:12,.0f} docs/s  {legacy_size} bytes")
+    print(f"orjson  (BSONJSONResponse):                      {fast * 1000:8.2f} ms  {n / fast:12,.0f} docs/s  {fast_size} bytes")
+    print(f"speedup: {legacy / fast:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -74,6 +74,21 @@ spec:
             port: 8000
           initialDelaySeconds: 5
           periodSeconds: 5
+        volumeMounts:
+        - name: prometheus-multiproc
+          mountPath: /tmp/prometheus-multiproc
+        - name: response-cache
+          mountPath: /dev/shm/response-cache
+      volumes:
+      # Thư mục metrics dùng chung cho các worker gunicorn trong pod
+      - name: prometheus-multiproc
+        emptyDir:
+          medium: Memory
+      # Cache response dùng chung (sharedcache.py, SHARED_CACHE_DIR): không phụ thuộc /dev/shm 64 MiB của container
+      - name: response-cache
+        emptyDir:
+          medium: Memory
+          sizeLimit: 32Mi
 ---
 apiVersion: v1
 kind: Service
@@ -8,9 +8,11 @@ import asyncio
 import json
 import logging
 import os
+import threading
 from typing import Dict, Any
 from aiokafka import AIOKafkaConsumer
-from prometheus_client import Counter, Histogram, Gauge, start_http_server
+from prometheus_client import Counter, Histogram, Gauge, REGISTRY, start_http_server
+from prometheus_client.core import Metric
 import time
 
 # Configure logging
@@ -22,6 +24,70 @@ metrics_received_total = Counter('kafka_metrics_received_total', 'Total metrics
 metrics_processing_duration = Histogram('kafka_metrics_processing_duration_seconds', 'Time spent processing metrics')
 service_metrics = {}  # Dynamic metrics storage
 
+
+class SnapshotCollector:
+    """
+    Prometheus collector for aggregated metric snapshots (type "metric_snapshot").
+
+    Snapshots carry deltas since the previous flush of the producer; they are
+    summed here into cumulative counters and histograms with the original
+    labels, named `{service}_{metric_name}`. `add` runs on the asyncio thread
+    and `collect` on the HTTP server thread, so both go through `self.lock`.
+    """
+
+    def __init__(self):
+        self.counters: Dict[tuple, float] = {}
+        self.histograms: Dict[tuple, Dict[str, Any]] = {}
+        self.lock = threading.Lock()
+
+    def add(self, data: Dict[str, Any]):
+        with self.lock:
+            self._add(data)
+
+    def _add(self, data: Dict[str, Any]):
+        service = data.get('service')
+        for series in data.get('series', []):
+            name = f"{service}_{series['metric_name']}"
+            key = (name, tuple(sorted(series.get('labels', {}).items())))
+            if series.get('kind') == 'counter':
+                self.counters[key] = self.counters.get(key, 0) + series['value']
+            elif series.get('kind') == 'histogram':
+                state = self.histograms.get(key)
+                if state is None or state['buckets'] != series['buckets']:
+                    # Series mới hoặc producer đổi bucket: bắt đầu lại
+                    state = self.histograms[key] = {
+                        'buckets': series['buckets'], 'counts': [0] * len(series['counts']), 'sum': 0.0, 'count': 0,
+                    }
+                state['counts'] = [a + b for a, b in zip(state['counts'], series['counts'])]
+                state['sum'] += series['sum']
+                state['count'] += series['count']
+            metrics_received_total.labels(service=service, metric_name=series['metric_name']).inc()
+
+    def collect(self):
+        # Chụp bản sao dưới lock rồi dựng Metric ngoài lock (add chỉ gán list counts mới, không sửa tại chỗ)
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: dict(state) for key, state in self.histograms.items()}
+        families: Dict[str, Metric] = {}
+        for (name, labels), value in counters.items():
+            family_name = name[:-len('_total')] if name.endswith('_total') else name
+            family = families.setdefault(family_name, Metric(family_name, f'Kafka metric: {name}', 'counter'))
+            family.add_sample(f'{family_name}_total', dict(labels), value)
+        for (name, labels), state in histograms.items():
+            family = families.setdefault(name, Metric(name, f'Kafka metric: {name}', 'histogram'))
+            cumulative = 0
+            bounds = [str(float(b)) for b in state['buckets']] + ['+Inf']
+            for bound, count in zip(bounds, state['counts']):
+                cumulative += count
+                family.add_sample(f'{name}_bucket', {**dict(labels), 'le': bound}, cumulative)
+            family.add_sample(f'{name}_count', dict(labels), state['count'])
+            family.add_sample(f'{name}_sum', dict(labels), state['sum'])
+        return list(families.values())
+
+
+snapshot_collector = SnapshotCollector()
+REGISTRY.register(snapshot_collector)
+
 class GrafanaKafkaConsumer:
     """Kafka Consumer for Grafana metrics"""
     
@@ -160,6 +226,8 @@ class GrafanaKafkaConsumer:
                     
                     if data_type == 'metric':
                         await self.process_metric(data)
+                    elif data_type == 'metric_snapshot':
+                        snapshot_collector.add(data)
                     elif data_type == 'health':
                         await self.process_health_check(data)
                     else:
@@ -6,9 +6,11 @@ Handles metrics, logs, and events publishing to Kafka topics
 
 import os
 import json
+import time
 import asyncio
 import logging
-from typing import Dict, Any, Optional
+from bisect import bisect_left
+from typing import Dict, Any, List, Optional, Sequence, Tuple
 from datetime import datetime
 from aiokafka import AIOKafkaProducer
 from aiokafka.errors import KafkaError
@@ -17,6 +19,150 @@ from aiokafka.errors import KafkaError
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Metric aggregation: gộp counter/histogram trong bộ nhớ, mỗi chu kỳ gửi một snapshot lên metrics.events
+METRICS_FLUSH_INTERVAL_SECONDS = float(os.getenv("KAFKA_METRICS_FLUSH_INTERVAL_SECONDS", "10"))
+# Số series tối đa trong một message snapshot; snapshot lớn hơn được chia thành nhiều message
+METRICS_FLUSH_MAX_SERIES = int(os.getenv("KAFKA_METRICS_FLUSH_MAX_SERIES", "500"))
+METRICS_HISTOGRAM_BUCKETS = tuple(
+    float(b) for b in os.getenv(
+        "KAFKA_METRICS_BUCKETS", "0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10"
+    ).split(",") if b.strip()
+)
+
+SeriesKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+class _HistogramState:
+    """Per-bucket counts (last one is +Inf), sum and count of one histogram series"""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsAggregator:
+    """
+    Accumulate counters and histograms in memory, keyed by (metric, labels).
+
+    Recording is synchronous and never touches Kafka, so it is cheap enough
+    for the request path. A background task swaps the accumulated series out
+    every `interval` seconds and publishes them as delta snapshots of at most
+    `max_series` series per message.
+    """
+
+    def __init__(
+        self,
+        producer: "KafkaProducer",
+        interval: float = METRICS_FLUSH_INTERVAL_SECONDS,
+        max_series: int = METRICS_FLUSH_MAX_SERIES,
+        buckets: Sequence[float] = METRICS_HISTOGRAM_BUCKETS,
+    ):
+        self.producer = producer
+        self.interval = interval
+        self.max_series = max(1, max_series)
+        self.buckets = tuple(sorted(buckets))
+        self._counters: Dict[SeriesKey, float] = {}
+        self._histograms: Dict[SeriesKey, _HistogramState] = {}
+        self._window_start = time.time()
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _key(metric_name: str, labels: Optional[Dict[str, str]]) -> SeriesKey:
+        return metric_name, tuple(sorted((k, str(v)) for k, v in (labels or {}).items()))
+
+    def increment(self, metric_name: str, value: float = 1, labels: Dict[str, str] = None):
+        """Add `value` to a counter series"""
+        key = self._key(metric_name, labels)
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, metric_name: str, value: float, labels: Dict[str, str] = None):
+        """Record one observation in a histogram series"""
+        key = self._key(metric_name, labels)
+        state = self._histograms.get(key)
+        if state is None:
+            state = self._histograms[key] = _HistogramState(self.buckets)
+        state.observe(value)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Stop the flush loop and publish what is left"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Failed to flush metrics: {e}")
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """Take the accumulated series (resetting them) as snapshot messages"""
+        counters, self._counters = self._counters, {}
+        histograms, self._histograms = self._histograms, {}
+        start, end = self._window_start, time.time()
+        self._window_start = end
+        series = [
+            {"kind": "counter", "metric_name": name, "labels": dict(labels), "value": value}
+            for (name, labels), value in counters.items()
+        ] + [
+            {
+                "kind": "histogram", "metric_name": name, "labels": dict(labels),
+                "buckets": list(state.buckets), "counts": state.counts, "sum": state.sum, "count": state.count,
+            }
+            for (name, labels), state in histograms.items()
+        ]
+        return [
+            {
+                "timestamp": datetime.utcnow().isoformat(),
+                "service": self.producer.service_name,
+                "window_start": start,
+                "window_end": end,
+                "series": series[i:i + self.max_series],
+                "type": "metric_snapshot",
+            }
+            for i in range(0, len(series), self.max_series)
+        ]
+
+    async def flush(self):
+        """Publish the accumulated series to metrics.events"""
+        messages = self.snapshot()
+        if not messages:
+            return
+        if not self.producer.is_connected:
+            # Không giữ lại: bộ nhớ không tăng theo thời gian Kafka bị mất
+            logger.warning(f"Kafka Producer not connected, dropping {len(messages)} metric snapshot(s)")
+            return
+        for message in messages:
+            try:
+                await self.producer.producer.send(
+                    'metrics.events',
+                    value=message,
+                    key=f"{self.producer.service_name}.snapshot"
+                )
+            except KafkaError as e:
+                logger.error(f"Failed to send metric snapshot: {e}")
+
+
 class KafkaProducer:
     """Kafka Producer for BT_API services"""
     
@@ -25,9 +171,12 @@ class KafkaProducer:
         self.bootstrap_servers = os.getenv("KAFKA_BOOTSTRAP", "host.docker.internal:9092")
         self.producer: Optional[AIOKafkaProducer] = None
         self.is_connected = False
+        self.metrics = MetricsAggregator(self)
         
     async def connect(self):
         """Connect to Kafka"""
+        # Chạy cả khi kết nối lỗi: snapshot khi đó bị bỏ thay vì dồn lại trong bộ nhớ
+        self.metrics.start()
         try:
             self.producer = AIOKafkaProducer(
                 bootstrap_servers=self.bootstrap_servers,
@@ -47,6 +196,7 @@ class KafkaProducer:
     
     async def disconnect(self):
         """Disconnect from Kafka"""
+        await self.metrics.stop()
         if self.producer:
             await self.producer.stop()
             self.is_connected = False
@@ -76,6 +226,14 @@ class KafkaProducer:
         except KafkaError as e:
             logger.error(f"Failed to send metric: {e}")
     
+    def increment_metric(self, metric_name: str, value: float = 1, labels: Dict[str, str] = None):
+        """Aggregate a counter increment; published with the next snapshot"""
+        self.metrics.increment(metric_name, value, labels)
+
+    def observe_metric(self, metric_name: str, value: float, labels: Dict[str, str] = None):
+        """Aggregate a histogram observation; published with the next snapshot"""
+        self.metrics.observe(metric_name, value, labels)
+
     async def send_log(self, level: str, message: str, extra: Dict[str, Any] = None):
         """Send log to Kafka"""
         if not self.is_connected:
@@ -164,6 +322,14 @@ async def send_metric(service_name: str, metric_name: str, value: float, labels:
     producer = get_kafka_producer(service_name)
     await producer.send_metric(metric_name, value, labels)
 
+def increment_metric(service_name: str, metric_name: str, value: float = 1, labels: Dict[str, str] = None):
+    """Aggregate a counter increment (sent to Kafka with the next snapshot)"""
+    get_kafka_producer(service_name).increment_metric(metric_name, value, labels)
+
+def observe_metric(service_name: str, metric_name: str, value: float, labels: Dict[str, str] = None):
+    """Aggregate a histogram observation (sent to Kafka with the next snapshot)"""
+    get_kafka_producer(service_name).observe_metric(metric_name, value, labels)
+
 async def send_log(service_name: str, level: str, message: str, extra: Dict[str, Any] = None):
     """Send log to Kafka"""
     producer = get_kafka_producer(service_name)
@@ -0,0 +1,138 @@
+"""
+Cache response trong process (TTL + LRU) cho các collection dữ liệu tham chiếu,
+invalidate bằng Mongo change stream (xem changes.CollectionWatcher), và singleflight
+cho các query giống nhau đang chạy đồng thời
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from fastapi import Request
+from prometheus_client import Counter, Gauge
+
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "30"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "256"))
+
+response_cache_hits_total = Counter(
+    'response_cache_hits_total', 'Response cache hits', ['cache']
+)
+response_cache_misses_total = Counter(
+    'response_cache_misses_total', 'Response cache misses', ['cache']
+)
+response_cache_evictions_total = Counter(
+    'response_cache_evictions_total', 'Response cache evictions', ['cache', 'reason']
+)
+response_cache_entries = Gauge(
+    'response_cache_entries', 'Entries currently held in the response cache', ['cache'],
+    multiprocess_mode='livesum',
+)
+singleflight_calls_total = Counter(
+    'singleflight_calls_total', 'Queries actually executed by the singleflight group', ['group']
+)
+singleflight_collapsed_total = Counter(
+    'singleflight_collapsed_total', 'Requests that joined an identical in-flight query', ['group']
+)
+
+
+def cache_key(request: Request) -> Tuple[Hashable, ...]:
+    """Normalize query params so equivalent requests share one entry"""
+    items = []
+    for name, value in request.query_params.multi_items():
+        if name == "fields":
+            value = ",".join(sorted(v.strip() for v in value.split(",") if v.strip()))
+        items.append((name, value))
+    return (request.url.path, tuple(sorted(items)))
+
+
+class ResponseCache:
+    """Bounded LRU cache with per-entry TTL, cleared whenever the watched collection changes"""
+
+    def __init__(self, name: str, max_entries: int = CACHE_MAX_ENTRIES, ttl: float = CACHE_TTL_SECONDS):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        # Tăng mỗi lần invalidate, để bỏ kết quả của query bắt đầu trước khi dữ liệu đổi
+        self.generation = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            response_cache_misses_total.labels(cache=self.name).inc()
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self._entries[key]
+            self._evicted("expired")
+            response_cache_misses_total.labels(cache=self.name).inc()
+            return None
+        self._entries.move_to_end(key)
+        response_cache_hits_total.labels(cache=self.name).inc()
+        return value
+
+    def set(self, key: Hashable, value: Any, generation: Optional[int] = None) -> None:
+        """Store `value`; skipped if the cache was invalidated since `generation` was read"""
+        if generation is not None and generation != self.generation:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._evicted("lru")
+        response_cache_entries.labels(cache=self.name).set(len(self._entries))
+
+    async def fill(self, key: Hashable, load: Callable[[], Awaitable[Any]], generation: Optional[int] = None) -> Any:
+        """Run `load` and store its result (see SharedResponseCache.fill for the cross-worker variant)"""
+        value = await load()
+        self.set(key, value, generation)
+        return value
+
+    def clear(self) -> None:
+        self.generation += 1
+        if self._entries:
+            response_cache_evictions_total.labels(cache=self.name, reason="invalidated").inc(len(self._entries))
+            self._entries.clear()
+        response_cache_entries.labels(cache=self.name).set(0)
+
+    def _evicted(self, reason: str) -> None:
+        response_cache_evictions_total.labels(cache=self.name, reason=reason).inc()
+        response_cache_entries.labels(cache=self.name).set(len(self._entries))
+
+    def on_change(self, event: Optional[Dict[str, Any]]) -> None:
+        """CollectionWatcher listener: any change (or a lost stream) empties the cache"""
+        self.clear()
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls with the same key into one execution.
+
+    The first caller starts the work; callers arriving while it runs await
+    the same future and share its result (or exception). The work is
+    shielded, so a disconnecting first caller does not cancel it for the rest.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, "asyncio.Future[Any]"] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._calls.get(key)
+        if future is not None:
+            singleflight_collapsed_total.labels(group=self.name).inc()
+        else:
+            singleflight_calls_total.labels(group=self.name).inc()
+            future = asyncio.ensure_future(fn())
+            self._calls[key] = future
+            future.add_done_callback(lambda f: self._forget(key, f))
+        return await asyncio.shield(future)
+
+    def _forget(self, key: Hashable, future: "asyncio.Future[Any]") -> None:
+        if self._calls.get(key) is future:
+            del self._calls[key]
+        if not future.cancelled():
+            # Tránh cảnh báo "exception was never retrieved" khi mọi caller đã bỏ đi
+            future.exception()
@@ -0,0 +1,163 @@
+"""
+Theo dõi thay đổi của collection qua Mongo change stream và version token cho conditional GET
+"""
+
+import asyncio
+import contextlib
+import hashlib
+import logging
+import os
+from typing import Any, Callable, Dict, List, Optional
+
+from bson import Timestamp
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# Thời gian chờ trước khi mở lại change stream bị lỗi
+CHANGE_STREAM_RETRY_SECONDS = float(os.getenv("CHANGE_STREAM_RETRY_SECONDS", "30"))
+
+# InvalidResumeToken, ChangeStreamFatalError, ChangeStreamHistoryLost: không thể tiếp tục từ token
+_RESUME_FAILED_CODES = (260, 280, 286)
+
+ChangeListener = Callable[[Optional[Dict[str, Any]]], None]
+
+
+class CollectionWatcher:
+    """
+    One change stream per collection, fanned out to listeners.
+
+    Listeners are called with each change event, or with None whenever the
+    stream is (re)opened or lost, meaning "changes may have been missed".
+    A reopened stream resumes after the last event seen (or `resume_token`);
+    `resumed` tells listeners whether the current stream did, i.e. whether
+    nothing was actually missed. A token the oplog no longer covers is
+    dropped and the stream restarts from now. `operation_time` is the
+    cluster time the live stream has caught up to.
+    """
+
+    def __init__(self, name: str, resume_token: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.live = False
+        self.resume_token = resume_token
+        self.resumed = False
+        self._listeners: List[ChangeListener] = []
+        self._task: Optional[asyncio.Task] = None
+        self._session = None
+
+    @property
+    def operation_time(self) -> Optional[Timestamp]:
+        """Cluster time covered by the live stream (every change up to it was seen); None if unknown"""
+        if not self.live or self._session is None:
+            return None
+        return self._session.operation_time
+
+    def subscribe(self, listener: ChangeListener) -> None:
+        self._listeners.append(listener)
+
+    def _notify(self, event: Optional[Dict[str, Any]]) -> None:
+        for listener in self._listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                logger.error(f"[{self.name}] change listener failed: {e}")
+
+    async def _watch(self, collection) -> None:
+        while True:
+            try:
+                # Session riêng của stream: operationTime của mỗi aggregate/getMore cho biết stream đã theo kịp tới đâu
+                async with await collection.database.client.start_session(causal_consistency=False) as session:
+                    async with collection.watch(resume_after=self.resume_token, session=session) as stream:
+                        self._session = session
+                        self.live = True
+                        self.resumed = self.resume_token is not None
+                        # Token của điểm mở stream: mất kết nối trước event đầu tiên vẫn tiếp tục được từ đây
+                        self.resume_token = stream.resume_token or self.resume_token
+                        self._notify(None)
+                        async for event in stream:
+                            self.resume_token = event["_id"]
+                            self._notify(event)
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                if not self.live and self.resume_token is not None and e.code in _RESUME_FAILED_CODES:
+                    # Oplog không còn giữ token (hoặc token không hợp lệ): mở lại ngay từ thời điểm hiện tại
+                    logger.warning(f"[{self.name}] cannot resume change stream, restarting from now: {e}")
+                    self.resume_token = None
+                    continue
+                logger.warning(f"[{self.name}] change stream unavailable: {e}")
+            except Exception as e:
+                logger.warning(f"[{self.name}] change stream unavailable: {e}")
+            finally:
+                self._session = None
+            self.live = False
+            self._notify(None)
+            await asyncio.sleep(CHANGE_STREAM_RETRY_SECONDS)
+
+    def start(self, collection) -> None:
+        """Start watching `collection` in the background"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._watch(collection))
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError, Exception):
+                await self._task
+            self._task = None
+        self.live = False
+
+
+class CollectionVersion:
+    """
+    Cheap version token for a collection.
+
+    While the watcher's change stream is live the token is the resume token
+    of the last change seen, so reading it costs nothing. Otherwise it is
+    recomputed per call from max(updatedAt) and the estimated document
+    count, which are served from an index and collection metadata without
+    touching documents.
+    """
+
+    def __init__(self, watcher: CollectionWatcher):
+        self.watcher = watcher
+        self._token: Optional[str] = None
+        self._generation = 0
+        watcher.subscribe(self.on_change)
+
+    def on_change(self, event: Optional[Dict[str, Any]]) -> None:
+        self._generation += 1
+        if event is None:
+            self._token = None
+        else:
+            self._token = str(event.get("_id", {}).get("_data", self._generation))
+
+    async def _compute(self, collection) -> str:
+        latest = await collection.find_one({}, {"updatedAt": 1}, sort=[("updatedAt", -1)])
+        count = await collection.estimated_document_count()
+        updated = latest.get("updatedAt") if latest else None
+        return f"{updated}:{count}"
+
+    async def token(self, collection) -> str:
+        if self.watcher.live and self._token is not None:
+            return self._token
+        generation = self._generation
+        token = await self._compute(collection)
+        if self.watcher.live and generation == self._generation:
+            self._token = token
+        return token
+
+
+def make_etag(token: str, key: Any) -> str:
+    """Strong ETag for one query (`key`) against one collection version"""
+    digest = hashlib.blake2b(f"{token}|{key!r}".encode(), digest_size=16).hexdigest()
+    return f'"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [c.strip() for c in if_none_match.split(",")]
+    # If-None-Match dùng weak comparison: bỏ tiền tố W/
+    candidates = [c[2:] if c.startswith("W/") else c for c in candidates]
+    return "*" in candidates or etag in candidates
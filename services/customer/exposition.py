@@ -0,0 +1,89 @@
+"""
+Xuất metrics Prometheus cho /metrics: khi chạy nhiều worker (gunicorn, PROMETHEUS_MULTIPROC_DIR)
+gộp giá trị của mọi worker từ thư mục chung của pod, thay vì chỉ trả số của worker nhận scrape.
+Việc render chạy trên thread riêng (không chặn event loop) và kết quả được dùng lại trong một
+khoảng ngắn cho các scrape đến cùng lúc (nhiều replica Prometheus)
+"""
+
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Histogram, generate_latest
+from prometheus_client import multiprocess, values
+
+# Phải được đặt trước khi import prometheus_client (gunicorn.conf.py / Dockerfile lo việc này)
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+# Scrape trong khoảng này sau lần render trước nhận lại đúng kết quả đó
+METRICS_CACHE_SECONDS = float(os.getenv("METRICS_CACHE_SECONDS", "1"))
+
+metrics_render_duration_seconds = Histogram(
+    'metrics_render_duration_seconds', 'Time spent rendering the /metrics exposition',
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+
+
+def _multiprocess_mode() -> bool:
+    """Whether prometheus_client itself writes values to PROMETHEUS_MULTIPROC_DIR"""
+    # Biến được đặt sau khi prometheus_client đã import (VD: qua load_dotenv) thì metric vẫn ở trong bộ nhớ:
+    # đọc thư mục lúc đó sẽ cho /metrics rỗng (hoặc lỗi nếu thư mục không tồn tại)
+    return (
+        bool(PROMETHEUS_MULTIPROC_DIR)
+        and os.path.isdir(PROMETHEUS_MULTIPROC_DIR)
+        and values.ValueClass is not values.MutexValue
+    )
+
+
+def _registry() -> CollectorRegistry:
+    if not _multiprocess_mode():
+        return REGISTRY
+    # Registry riêng chỉ có collector đọc file của các worker (registry mặc định chỉ thấy process này)
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, path=PROMETHEUS_MULTIPROC_DIR)
+    return registry
+
+
+registry = _registry()
+
+
+def render_metrics() -> bytes:
+    """Text exposition of every metric, aggregated across workers in multiprocess mode"""
+    return generate_latest(registry)
+
+
+# Một thread là đủ: mỗi lúc chỉ có một lần render (các scrape khác chờ chung kết quả)
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="metrics-render")
+_cached: Optional[bytes] = None
+_cached_at = 0.0
+_rendering: Optional[asyncio.Future] = None
+
+
+def _timed_render() -> bytes:
+    started = time.perf_counter()
+    try:
+        return render_metrics()
+    finally:
+        metrics_render_duration_seconds.observe(time.perf_counter() - started)
+
+
+async def _render() -> bytes:
+    global _cached, _cached_at, _rendering
+    try:
+        data = await asyncio.get_running_loop().run_in_executor(_executor, _timed_render)
+        _cached, _cached_at = data, time.monotonic()
+        return data
+    finally:
+        _rendering = None
+
+
+async def metrics_exposition() -> bytes:
+    """render_metrics() off the event loop, shared by concurrent scrapes and reused for METRICS_CACHE_SECONDS"""
+    global _rendering
+    if _cached is not None and time.monotonic() - _cached_at < METRICS_CACHE_SECONDS:
+        return _cached
+    if _rendering is None:
+        _rendering = asyncio.ensure_future(_render())
+    # shield: một scrape bị huỷ (client ngắt) không huỷ lần render mà các scrape khác đang chờ
+    return await asyncio.shield(_rendering)
@@ -0,0 +1,229 @@
+"""
+Cache response dùng chung giữa các worker trong cùng container: response đã serialize được giữ
+trong một file mmap (mặc định trên /dev/shm), mỗi pod chỉ tốn bộ nhớ một lần và worker mới
+khởi động đọc được ngay cache đã có
+
+Bố cục file: header (magic, số slot, kích thước slot, generation) + N slot cố định, mỗi slot
+gồm metadata (seq, hash của key, generation, hạn, độ dài) và vùng dữ liệu. Key được ánh xạ
+thẳng vào một slot theo hash (trùng slot thì entry mới ghi đè entry cũ)
+"""
+
+import asyncio
+import errno
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from cache import (
+    CACHE_TTL_SECONDS,
+    ResponseCache,
+    response_cache_evictions_total,
+    response_cache_hits_total,
+    response_cache_misses_total,
+)
+
+logger = logging.getLogger(__name__)
+
+# Bật khi chạy nhiều worker trong một container (xem Dockerfile)
+RESPONSE_CACHE_SHARED = os.getenv("RESPONSE_CACHE_SHARED", "false").lower() == "true"
+SHARED_CACHE_DIR = os.getenv(
+    "SHARED_CACHE_DIR",
+    "/dev/shm/response-cache" if os.path.isdir("/dev/shm") else os.path.join(tempfile.gettempdir(), "response-cache"),
+)
+# Mặc định ~16 MiB mỗi cache: phải nằm gọn trong /dev/shm của container (Docker mặc định 64 MiB)
+SHARED_CACHE_SLOTS = int(os.getenv("SHARED_CACHE_SLOTS", "128"))
+# Response lớn hơn kích thước slot không được cache
+SHARED_CACHE_SLOT_BYTES = int(os.getenv("SHARED_CACHE_SLOT_BYTES", str(128 * 1024)))
+# Worker không giành được quyền ghi sẽ chờ worker kia tối đa chừng này rồi tự query
+SHARED_CACHE_WAIT_SECONDS = float(os.getenv("SHARED_CACHE_WAIT_SECONDS", "0.2"))
+
+_MAGIC = b"RSPCACH1"
+_HEADER = struct.Struct("<8sQQQ")  # magic, slots, slot_bytes, generation
+_HEADER_SIZE = 64
+_GENERATION_OFFSET = 24
+_SEQ = struct.Struct("<Q")
+# seq (lẻ khi đang ghi), key hash, generation, hạn (epoch), độ dài dữ liệu
+_META = struct.Struct("<QQQdI")
+_META_SIZE = 64
+_POLL_SECONDS = 0.005
+
+
+def _reserve(fd: int, directory: str, size: int) -> None:
+    # File thưa trên tmpfs đầy không báo lỗi lúc tạo mà gây SIGBUS khi ghi trang sau này:
+    # kiểm tra chỗ trống và cấp phát hết ngay để lỗi (OSError) xảy ra lúc mở, khi còn fallback được
+    stat = os.statvfs(directory)
+    free = stat.f_bavail * stat.f_frsize
+    if size > free:
+        raise OSError(errno.ENOSPC, f"shared response cache needs {size} bytes, {free} free in {directory}")
+    os.posix_fallocate(fd, 0, size)
+
+
+def _key_hash(key: Hashable) -> int:
+    return int.from_bytes(hashlib.blake2b(repr(key).encode(), digest_size=8).digest(), "little")
+
+
+class SharedResponseCache:
+    """
+    mmap-backed cache of serialized responses shared by every worker of a pod.
+
+    Entries are versioned twice: a per-slot sequence number (odd while a
+    write is in progress, so readers drop torn reads) and the cache-wide
+    generation in the header, which `clear` bumps to invalidate everything at
+    once. On a miss, `fill` lets only the worker holding the slot's lock
+    (fcntl) query Mongo and write; the others wait for that entry. Same
+    interface as ResponseCache, with bytes values.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        directory: str = SHARED_CACHE_DIR,
+        slots: int = SHARED_CACHE_SLOTS,
+        slot_bytes: int = SHARED_CACHE_SLOT_BYTES,
+        ttl: float = CACHE_TTL_SECONDS,
+    ):
+        self.name = name
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.ttl = ttl
+        self._stride = _META_SIZE + slot_bytes
+        size = _HEADER_SIZE + slots * self._stride
+        os.makedirs(directory, exist_ok=True)
+        self._fd = os.open(os.path.join(directory, f"{name}.cache"), os.O_RDWR | os.O_CREAT, 0o600)
+        # Khoá byte 0 khi khởi tạo để hai worker khởi động cùng lúc không ghi header chồng nhau
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, 0)
+        try:
+            header = os.pread(self._fd, _HEADER.size, 0)
+            valid = (
+                os.fstat(self._fd).st_size == size
+                and len(header) == _HEADER.size
+                and _HEADER.unpack(header)[:3] == (_MAGIC, slots, slot_bytes)
+            )
+            if not valid:
+                # File mới hoặc cấu hình khác: làm lại từ đầu (cắt về 0 rồi cấp phát lại, toàn byte 0)
+                os.ftruncate(self._fd, 0)
+                _reserve(self._fd, directory, size)
+                os.pwrite(self._fd, _HEADER.pack(_MAGIC, slots, slot_bytes, 0), 0)
+            self._mm = mmap.mmap(self._fd, size)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, 0)
+        self._locked: Dict[int, int] = {}
+
+    @property
+    def generation(self) -> int:
+        return _SEQ.unpack_from(self._mm, _GENERATION_OFFSET)[0]
+
+    def _slot(self, key_hash: int) -> int:
+        return _HEADER_SIZE + (key_hash % self.slots) * self._stride
+
+    def _read(self, key_hash: int) -> Optional[bytes]:
+        base = self._slot(key_hash)
+        seq, found, generation, expires, length = _META.unpack_from(self._mm, base)
+        if seq & 1 or found != key_hash or generation != self.generation or expires < time.time():
+            return None
+        value = self._mm[base + _META_SIZE: base + _META_SIZE + length]
+        # Slot bị ghi trong lúc đọc: bỏ kết quả
+        if _SEQ.unpack_from(self._mm, base)[0] != seq:
+            return None
+        return value
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        value = self._read(_key_hash(key))
+        if value is None:
+            response_cache_misses_total.labels(cache=self.name).inc()
+            return None
+        response_cache_hits_total.labels(cache=self.name).inc()
+        return value
+
+    def set(self, key: Hashable, value: bytes, generation: Optional[int] = None) -> None:
+        """Store `value`; skipped if the cache was invalidated since `generation` was read"""
+        if generation is not None and generation != self.generation:
+            return
+        if len(value) > self.slot_bytes:
+            response_cache_evictions_total.labels(cache=self.name, reason="too_large").inc()
+            return
+        key_hash = _key_hash(key)
+        base = self._slot(key_hash)
+        if not self._lock(base):
+            return
+        try:
+            seq = _SEQ.unpack_from(self._mm, base)[0]
+            if seq & 1:
+                # Worker trước chết giữa lúc ghi slot này
+                seq += 1
+            previous = _META.unpack_from(self._mm, base)[1]
+            if previous and previous != key_hash:
+                response_cache_evictions_total.labels(cache=self.name, reason="collision").inc()
+            # seq lẻ trong lúc ghi: reader đọc trúng sẽ bỏ qua
+            _SEQ.pack_into(self._mm, base, seq + 1)
+            self._mm[base + _META_SIZE: base + _META_SIZE + len(value)] = value
+            _META.pack_into(
+                self._mm, base, seq + 1, key_hash,
+                self.generation if generation is None else generation, time.time() + self.ttl, len(value),
+            )
+            _SEQ.pack_into(self._mm, base, seq + 2)
+        finally:
+            self._unlock(base)
+
+    async def fill(self, key: Hashable, load: Callable[[], Awaitable[bytes]], generation: Optional[int] = None) -> bytes:
+        """Load and store the entry for `key` in at most one worker of the pod at a time"""
+        key_hash = _key_hash(key)
+        base = self._slot(key_hash)
+        if self._lock(base):
+            try:
+                value = await load()
+                self.set(key, value, generation)
+                return value
+            finally:
+                self._unlock(base)
+        deadline = time.monotonic() + SHARED_CACHE_WAIT_SECONDS
+        while time.monotonic() < deadline:
+            await asyncio.sleep(_POLL_SECONDS)
+            value = self._read(key_hash)
+            if value is not None:
+                response_cache_hits_total.labels(cache=self.name).inc()
+                return value
+        # Worker giữ khoá chậm hoặc đang ghi key khác cùng slot: tự query, không ghi
+        return await load()
+
+    def clear(self) -> None:
+        # Header chỉ tăng: hai worker cùng tăng thì giá trị vẫn khác generation cũ
+        _SEQ.pack_into(self._mm, _GENERATION_OFFSET, self.generation + 1)
+
+    def on_change(self, event: Optional[Dict[str, Any]]) -> None:
+        """CollectionWatcher listener: any change (or a lost stream) invalidates every entry"""
+        self.clear()
+
+    def _lock(self, base: int) -> bool:
+        # Khoá fcntl thuộc về process: đếm số lần giữ trong process để chỉ mở khoá ở lần cuối
+        held = self._locked.get(base, 0)
+        if not held:
+            try:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, base)
+            except OSError:
+                return False
+        self._locked[base] = held + 1
+        return True
+
+    def _unlock(self, base: int) -> None:
+        held = self._locked.pop(base) - 1
+        if held:
+            self._locked[base] = held
+        else:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, base)
+
+
+def open_response_cache(name: str):
+    """SharedResponseCache when RESPONSE_CACHE_SHARED is on (several workers), ResponseCache otherwise"""
+    if RESPONSE_CACHE_SHARED:
+        try:
+            return SharedResponseCache(name)
+        except OSError as e:
+            logger.warning(f"[{name}] shared response cache unavailable, using per-process cache: {e}")
+    return ResponseCache(name)
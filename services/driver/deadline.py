@@ -0,0 +1,140 @@
+"""
+Deadline cho từng request: mặc định theo route, client có thể đổi qua header (có giới hạn trên).
+Thời gian còn lại được đẩy xuống Mongo dưới dạng maxTimeMS; quá hạn thì huỷ handler và trả 504.
+Deadline chỉ áp dụng tới khi response bắt đầu được gửi: body stream (VD: NDJSON export) không bị cắt
+"""
+
+import asyncio
+import logging
+import os
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+import orjson
+from prometheus_client import Counter
+from pymongo.errors import ExecutionTimeout
+from starlette.routing import Match
+
+logger = logging.getLogger(__name__)
+
+REQUEST_DEADLINE_MS = int(os.getenv("REQUEST_DEADLINE_MS", "10000"))
+# Giới hạn trên cho cả cấu hình route lẫn header của client
+REQUEST_DEADLINE_MAX_MS = int(os.getenv("REQUEST_DEADLINE_MAX_MS", "30000"))
+DEADLINE_HEADER = b"x-request-timeout-ms"
+
+http_request_deadline_exceeded_total = Counter(
+    'http_request_deadline_exceeded_total', 'Requests stopped because their deadline passed', ['route', 'stage']
+)
+
+# Thời điểm hết hạn (loop.time()) của request hiện tại; None ngoài request (task nền)
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+def remaining_ms() -> Optional[int]:
+    """Milliseconds left before the current request's deadline, at least 1; None without a deadline"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return max(1, int((deadline - asyncio.get_running_loop().time()) * 1000))
+
+
+def with_deadline(cursor):
+    """Apply the remaining request time to a Motor cursor as maxTimeMS"""
+    ms = remaining_ms()
+    return cursor.max_time_ms(ms) if ms is not None else cursor
+
+
+def use_shared_deadline() -> None:
+    """
+    Replace the current task's inherited request deadline with REQUEST_DEADLINE_MAX_MS.
+
+    For work shared by several requests (singleflight loads): the shared
+    query is not cut short by the budget of whichever request started it,
+    while each caller still stops waiting at its own deadline.
+    """
+    _deadline.set(asyncio.get_running_loop().time() + REQUEST_DEADLINE_MAX_MS / 1000)
+
+
+def route_template(scope) -> Optional[str]:
+    """Path template of the route matching `scope` (e.g. /orders/{order_id}), None if nothing matches"""
+    app = scope.get("app")
+    for route in getattr(getattr(app, "router", None), "routes", []):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return None
+
+
+class DeadlineMiddleware:
+    """
+    Run each HTTP request under a deadline.
+
+    The budget is `routes[template]` (or `default_ms`), replaced by the
+    X-Request-Timeout-Ms header when present, and capped at `max_ms`. When it
+    runs out, or Mongo reports ExecutionTimeout, before the response starts,
+    the handler is cancelled (freeing the Mongo cursor and connection) and a
+    504 is sent. Once http.response.start has gone out the deadline is
+    lifted, so streamed bodies such as NDJSON exports run to completion.
+    """
+
+    def __init__(
+        self,
+        app,
+        routes: Optional[Dict[str, int]] = None,
+        default_ms: int = REQUEST_DEADLINE_MS,
+        max_ms: int = REQUEST_DEADLINE_MAX_MS,
+    ):
+        self.app = app
+        self.routes = routes or {}
+        self.default_ms = default_ms
+        self.max_ms = max_ms
+
+    def _budget_ms(self, scope, route: Optional[str]) -> int:
+        budget = self.routes.get(route, self.default_ms)
+        for name, value in scope.get("headers", []):
+            if name == DEADLINE_HEADER:
+                try:
+                    budget = int(value)
+                except ValueError:
+                    pass
+                break
+        return max(1, min(budget, self.max_ms))
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        route = route_template(scope)
+        budget = self._budget_ms(scope, route)
+        started = False
+        timeout = asyncio.timeout(budget / 1000)
+
+        async def send_tracked(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+                # Response đã bắt đầu: bỏ deadline cho phần body còn lại (kể cả maxTimeMS của query sau đó)
+                timeout.reschedule(None)
+                _deadline.set(None)
+            await send(message)
+
+        token = _deadline.set(asyncio.get_running_loop().time() + budget / 1000)
+        try:
+            async with timeout:
+                await self.app(scope, receive, send_tracked)
+        except (asyncio.TimeoutError, ExecutionTimeout):
+            stage = "body" if started else "handler"
+            http_request_deadline_exceeded_total.labels(route=route or "unmatched", stage=stage).inc()
+            logger.warning(f"Deadline of {budget} ms exceeded for {scope['method']} {scope['path']} ({stage})")
+            if started:
+                # Đã gửi header: chỉ có thể cắt kết nối
+                raise
+            body = orjson.dumps({"detail": f"Request deadline of {budget} ms exceeded"})
+            await send({
+                "type": "http.response.start",
+                "status": 504,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+            })
+            await send({"type": "http.response.body", "body": body})
+        finally:
+            _deadline.reset(token)
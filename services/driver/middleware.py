@@ -0,0 +1,103 @@
+"""
+Middleware ASGI thuần đo request HTTP cho mọi service: đếm request và đo thời gian theo
+route template (VD: /orders/{order_id}) thay vì path thật, để số series không tăng theo id
+"""
+
+import os
+import time
+from typing import Awaitable, Callable, Dict, Optional, Sequence, Tuple
+
+from prometheus_client import Counter, Histogram
+
+# Bucket (giây) cho histogram thời gian request, phân cách bằng dấu phẩy
+HTTP_DURATION_BUCKETS = tuple(
+    float(b) for b in os.getenv(
+        "HTTP_DURATION_BUCKETS", "0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10"
+    ).split(",") if b.strip()
+)
+# Nhãn endpoint cho request không khớp route nào (404), gộp chung một series
+UNMATCHED_ROUTE = "unmatched"
+
+RequestObserver = Callable[[str, str, str, float], Optional[Awaitable[None]]]
+
+_metrics: Dict[str, Tuple[Counter, Histogram]] = {}
+
+
+def http_metrics(prefix: str, buckets: Sequence[float] = HTTP_DURATION_BUCKETS) -> Tuple[Counter, Histogram]:
+    """`{prefix}_http_requests_total` and `{prefix}_http_request_duration_seconds`, registered once"""
+    if prefix not in _metrics:
+        _metrics[prefix] = (
+            Counter(
+                f'{prefix}_http_requests_total', f'Total HTTP requests ({prefix})', ['method', 'endpoint', 'status']
+            ),
+            Histogram(
+                f'{prefix}_http_request_duration_seconds', f'HTTP request duration ({prefix})', ['method', 'endpoint'],
+                buckets=buckets,
+            ),
+        )
+    return _metrics[prefix]
+
+
+def _endpoint_paths(app, endpoint: Optional[Callable]) -> Dict[Callable, str]:
+    if app is None:
+        return {}
+    paths = getattr(app, "_endpoint_paths", None)
+    # Dựng lại khi có route mới được thêm sau request đầu tiên
+    if paths is None or (endpoint is not None and endpoint not in paths):
+        paths = {}
+        for route in getattr(getattr(app, "router", None), "routes", []):
+            route_endpoint = getattr(route, "endpoint", None)
+            if route_endpoint is not None:
+                paths.setdefault(route_endpoint, route.path)
+        app._endpoint_paths = paths
+    return paths
+
+
+class MetricsMiddleware:
+    """
+    Count and time every HTTP request, labelled by method, route template and status.
+
+    The router stores the matched endpoint in the (shared) scope, so the
+    template is looked up once the app returns, with no second route match.
+    Timing uses perf_counter and covers the whole response body, streamed
+    ones included. `observer(method, endpoint, status, seconds)` is called
+    after each request for extra sinks; it may be async.
+    """
+
+    def __init__(
+        self,
+        app,
+        prefix: str,
+        buckets: Sequence[float] = HTTP_DURATION_BUCKETS,
+        observer: Optional[RequestObserver] = None,
+    ):
+        self.app = app
+        self.requests_total, self.duration_seconds = http_metrics(prefix, buckets)
+        self.observer = observer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+        started = time.perf_counter()
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            duration = time.perf_counter() - started
+            method = scope["method"]
+            matched = scope.get("endpoint")
+            endpoint = _endpoint_paths(scope.get("app"), matched).get(matched, UNMATCHED_ROUTE)
+            self.requests_total.labels(method=method, endpoint=endpoint, status=str(status)).inc()
+            self.duration_seconds.labels(method=method, endpoint=endpoint).observe(duration)
+            if self.observer is not None:
+                result = self.observer(method, endpoint, str(status), duration)
+                if result is not None:
+                    await result
@@ -1,25 +1,159 @@
-from fastapi import APIRouter, HTTPException
-from db import db
+import asyncio
+from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Request, Body, Query
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from db import REFERENCE_MAX_STALENESS_SECONDS, REFERENCE_READ_PREFERENCE, db, hedge_reader, reader
+from changes import CollectionVersion, CollectionWatcher
+from counting import CountCache
+from indexes import ensure_indexes
+from listing import DEFAULT_PAGE_SIZE, batch_get, count_documents, list_documents
+from loader import BatchLoader, parse_id
+from sharedcache import open_response_cache
+from serialization import BSONJSONResponse
 
 router = APIRouter()
 
+# Các field client được phép chọn qua ?fields= (projection đẩy xuống Mongo)
+DRIVER_FIELDS = {
+    "driverId",
+    "name",
+    "phone",
+    "licenseNumber",
+    "status",
+    "vehicleId",
+    "createdAt",
+    "updatedAt",
+}
+
+# Field được phép filter (?field=value hoặc ?field=a,b) và hàm chuyển kiểu giá trị
+DRIVER_FILTERS = {
+    "driverId": str,
+    "status": str,
+    "vehicleId": str,
+    "phone": str,
+}
+
+# Index khai báo cho collection: được tạo lúc startup (indexes.ensure_indexes) và query planner
+# dựa vào đây để từ chối query quét toàn bộ collection. TTL: IndexModel(..., expireAfterSeconds=N)
+DRIVER_INDEXES = [
+    IndexModel([("driverId", ASCENDING)], unique=True),
+    IndexModel([("status", ASCENDING), ("_id", ASCENDING)]),
+    IndexModel([("vehicleId", ASCENDING), ("_id", ASCENDING)]),
+    IndexModel([("phone", ASCENDING), ("_id", ASCENDING)]),
+    IndexModel([("updatedAt", DESCENDING)]),
+]
+
+# (collection, index spec) của service, dùng cho startup và `python indexes.py`
+INDEX_SPECS = [("Driver", DRIVER_INDEXES)]
+
+# Deadline (ms) riêng cho từng route (theo path template); route khác dùng REQUEST_DEADLINE_MS
+ROUTE_DEADLINES_MS = {
+    "/driver/{driver_id}": 2000,
+    "/driver:batchGet": 3000,
+    "/driver/count": 3000,
+}
+
+# Dữ liệu tham chiếu chấp nhận trễ nhẹ: đọc theo read preference riêng (trang list có cache/ETag
+# vẫn chờ secondary theo kịp change stream trước khi đọc, xem list_documents)
+driver_reads = reader("Driver", REFERENCE_READ_PREFERENCE, REFERENCE_MAX_STALENESS_SECONDS)
+# Collection dùng cho hedged read (None nếu MONGODB_HEDGED_READS tắt)
+driver_hedge = hedge_reader("Driver", REFERENCE_READ_PREFERENCE)
+
+# Change stream của collection: invalidate cache, cập nhật version token cho ETag và làm mới count
+driver_watcher = CollectionWatcher("driver")
+driver_version = CollectionVersion(driver_watcher)
+driver_counts = CountCache("driver", driver_watcher)
+
+# Dữ liệu tham chiếu, đọc nhiều: cache response (dùng chung giữa các worker nếu RESPONSE_CACHE_SHARED)
+driver_cache = open_response_cache("driver")
+driver_watcher.subscribe(driver_cache.on_change)
+
+# Gộp các lookup theo id đồng thời thành một query $in
+driver_loader = BatchLoader("driver", driver_reads, hedge_collection=driver_hedge) if db is not None else None
+
+_index_task: Optional[asyncio.Future] = None
+
+
+@router.on_event("startup")
+async def _start_change_watcher():
+    if db is not None:
+        driver_watcher.start(db.Driver)
+        driver_counts.start(driver_reads)
+
+
+@router.on_event("startup")
+async def _ensure_indexes():
+    global _index_task
+    if db is not None:
+        # Chạy nền để việc build index trên collection lớn không chặn readiness
+        _index_task = asyncio.gather(*(ensure_indexes(db[name], spec) for name, spec in INDEX_SPECS))
+
+
+@router.on_event("shutdown")
+async def _stop_change_watcher():
+    await driver_watcher.stop()
+    await driver_counts.stop()
+
 
 @router.get("/driver")
-async def get_orders():
+async def get_orders(
+    request: Request,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1),
+    after: Optional[str] = Query(None, description="Cursor `next` của trang trước"),
+    stream: bool = Query(False, description="Trả về NDJSON stream toàn bộ collection"),
+    fields: Optional[str] = Query(None, description="Danh sách field, phân cách bằng dấu phẩy"),
+    sort: Optional[str] = Query(None, description="VD: -createdAt (dấu - là giảm dần)"),
+):
+    if db is None:
+        raise HTTPException(status_code=500, detail="MONGODB_URI is not configured")
+    return await list_documents(
+        request,
+        driver_reads,
+        limit=limit,
+        after=after,
+        stream=stream,
+        fields=fields,
+        sort=sort,
+        allowed_fields=DRIVER_FIELDS,
+        filters=DRIVER_FILTERS,
+        indexes=DRIVER_INDEXES,
+        cache=driver_cache,
+        version=driver_version,
+        hedge=driver_hedge,
+    )
+
+
+@router.get("/driver/count")
+async def count_driver(request: Request):
+    if db is None:
+        raise HTTPException(status_code=500, detail="MONGODB_URI is not configured")
+    return await count_documents(request, driver_reads, driver_counts, DRIVER_FILTERS, DRIVER_INDEXES)
+
+
+@router.post("/driver:batchGet")
+async def batch_get_driver(ids: List[str] = Body(..., embed=True)):
+    if db is None:
+        raise HTTPException(status_code=500, detail="MONGODB_URI is not configured")
+    return await batch_get(driver_loader, ids)
+
+
+# Route /driver/{id} để cuối cùng: các route GET /driver/<tên> cố định phải khai báo phía trên
+@router.get("/driver/{driver_id}")
+async def get_driver_by_id(driver_id: str):
     if db is None:
         raise HTTPException(status_code=500, detail="MONGODB_URI is not configured")
-    docs = await db.Driver.find().to_list(length=None)
-    for d in docs:
-        if "_id" in d:
-            d["_id"] = str(d["_id"])  # serialize ObjectId
-    return docs
+    doc = await driver_loader.load(parse_id(driver_id))
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Driver not found")
+    return BSONJSONResponse(content=doc)
     
 
 # uvicorn main:app --reload --host 0.0.0.0 --port 8000
 
 # Prometheus metrics
 from fastapi.responses import Response
-from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import Counter, Histogram
+from exposition import CONTENT_TYPE_LATEST, metrics_exposition
 
 # Metrics definitions
 http_requests_total = Counter('http_requests_total', 'Total HTTP requests', ['method', 'endpoint', 'status'])
@@ -28,5 +162,5 @@ http_request_duration_seconds = Histogram('http_request_duration_seconds', 'HTTP
 @router.get("/metrics")
 async def metrics():
     """Prometheus metrics endpoint"""
-    data = generate_latest()
+    data = await metrics_exposition()
     return Response(content=data, media_type=CONTENT_TYPE_LATEST)
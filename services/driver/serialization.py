@@ -0,0 +1,35 @@
+"""
+Serialize response JSON nhanh bằng orjson, encode trực tiếp các kiểu BSON (ObjectId, Decimal128, ...)
+"""
+
+from typing import Any
+
+import orjson
+from bson import Decimal128, ObjectId
+from fastapi.responses import JSONResponse
+
+
+def _bson_default(value: Any) -> Any:
+    # orjson tự xử lý datetime, UUID, dict/list...; chỉ các kiểu BSON rơi vào đây
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, Decimal128):
+        return str(value.to_decimal())
+    return str(value)
+
+
+def dumps(content: Any) -> bytes:
+    """Encode `content` (raw Mongo documents allowed) to JSON bytes in one pass"""
+    return orjson.dumps(content, default=_bson_default)
+
+
+class BSONJSONResponse(JSONResponse):
+    """
+    JSONResponse that renders with orjson and understands BSON types.
+
+    Return it directly from a handler so FastAPI skips jsonable_encoder:
+    documents go from Motor to bytes without a per-document `_id` rewrite.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,181 @@
+"""
+Đếm document không chặn request: estimated_document_count cho toàn collection, count_documents
+(chỉ với filter có index) được cache và làm mới nền theo chu kỳ, hoặc khi change stream báo một thay đổi
+có thể làm đổi kết quả của filter đó
+"""
+
+import asyncio
+import contextlib
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional, Set, Tuple
+
+from bson import json_util
+from prometheus_client import Counter
+
+from changes import CollectionWatcher
+from deadline import remaining_ms
+
+logger = logging.getLogger(__name__)
+
+COUNT_REFRESH_SECONDS = float(os.getenv("COUNT_REFRESH_SECONDS", "60"))
+# Khoảng cách tối thiểu giữa hai lần làm mới khi có nhiều thay đổi liên tiếp
+COUNT_MIN_REFRESH_SECONDS = float(os.getenv("COUNT_MIN_REFRESH_SECONDS", "1"))
+COUNT_MAX_ENTRIES = int(os.getenv("COUNT_MAX_ENTRIES", "128"))
+
+count_cache_requests_total = Counter(
+    'count_cache_requests_total', 'Count requests by how they were served', ['counter', 'result']
+)
+count_cache_refreshes_total = Counter(
+    'count_cache_refreshes_total', 'Counts recomputed against Mongo', ['counter']
+)
+
+
+def _filter_key(filters: Dict[str, Any]) -> Hashable:
+    return json_util.dumps(filters, sort_keys=True)
+
+
+def _matches(filters: Dict[str, Any], document: Dict[str, Any]) -> bool:
+    for field, condition in filters.items():
+        value = document.get(field)
+        if isinstance(condition, dict):
+            if set(condition) != {"$in"}:
+                # Toán tử khác: không tự đánh giá được, coi như khớp
+                continue
+            if value not in condition["$in"]:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+def affects_count(filters: Dict[str, Any], event: Dict[str, Any]) -> bool:
+    """Whether the change `event` may change the number of documents matching `filters`"""
+    operation = event.get("operationType")
+    if operation == "insert" and "fullDocument" in event:
+        return _matches(filters, event["fullDocument"])
+    if operation == "update":
+        # Update không đụng tới field nào của filter thì không đổi số lượng
+        description = event.get("updateDescription") or {}
+        touched = {
+            field.split(".")[0]
+            for field in list(description.get("updatedFields", {})) + list(description.get("removedFields", []))
+        }
+        return bool(touched & set(filters))
+    # delete / replace / drop ...: event không có bản cũ của document
+    return True
+
+
+class CountCache:
+    """
+    Cached collection counts, one entry per filter.
+
+    Requests are answered from the cache; only the first request for a new
+    filter waits for Mongo. A background task recomputes, debounced, only
+    the entries a change event may affect (an insert matching the filter, an
+    update touching one of its fields, any delete or replace), and every
+    entry each COUNT_REFRESH_SECONDS whatever the change traffic. A count
+    computed while a change event arrived is refreshed again.
+    """
+
+    def __init__(self, name: str, watcher: Optional[CollectionWatcher] = None, max_entries: int = COUNT_MAX_ENTRIES):
+        self.name = name
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[Dict[str, Any], int, float]]" = OrderedDict()
+        self._changed = asyncio.Event()
+        self._dirty: Set[Hashable] = set()
+        # Tăng mỗi lần có event, để biết count vừa tính có thể đã lỡ một thay đổi
+        self._generation = 0
+        self._task: Optional[asyncio.Task] = None
+        if watcher is not None:
+            watcher.subscribe(self.on_change)
+
+    def on_change(self, event: Optional[Dict[str, Any]]) -> None:
+        self._generation += 1
+        if event is None:
+            # Stream mở lại / mất: có thể đã lỡ thay đổi
+            dirty = list(self._entries)
+        else:
+            dirty = [key for key, (filters, _, _) in self._entries.items() if affects_count(filters, event)]
+        if dirty:
+            self._dirty.update(dirty)
+            self._changed.set()
+
+    async def _compute(self, collection, filters: Dict[str, Any]) -> int:
+        count_cache_refreshes_total.labels(counter=self.name).inc()
+        # Trong request: giới hạn theo deadline; làm mới nền thì không giới hạn
+        ms = remaining_ms()
+        options = {"maxTimeMS": ms} if ms is not None else {}
+        if not filters:
+            # Đọc từ metadata của collection, không quét document
+            return await collection.estimated_document_count(**options)
+        return await collection.count_documents(filters, **options)
+
+    async def count(self, collection, filters: Dict[str, Any]) -> Tuple[int, float]:
+        """Return (count, computed_at) for `filters`"""
+        key = _filter_key(filters)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            count_cache_requests_total.labels(counter=self.name, result="hit").inc()
+            return entry[1], entry[2]
+        count_cache_requests_total.labels(counter=self.name, result="miss").inc()
+        generation = self._generation
+        value = await self._compute(collection, filters)
+        computed_at = time.time()
+        self._entries[key] = (filters, value, computed_at)
+        if generation != self._generation:
+            # Event đến trong lúc tính (khi entry chưa có nên on_change không đánh dấu được)
+            self._dirty.add(key)
+            self._changed.set()
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return value, computed_at
+
+    async def _refresh(self, collection, keys: Iterable[Hashable]) -> None:
+        for key in keys:
+            entry = self._entries.get(key)
+            if entry is None:
+                continue
+            filters = entry[0]
+            try:
+                value = await self._compute(collection, filters)
+            except Exception as e:
+                logger.warning(f"[{self.name}] count refresh failed: {e}")
+                continue
+            if key in self._entries:
+                self._entries[key] = (filters, value, time.time())
+
+    async def _refresh_loop(self, collection) -> None:
+        loop = asyncio.get_running_loop()
+        full_at = loop.time() + COUNT_REFRESH_SECONDS
+        while True:
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=max(0.0, full_at - loop.time()))
+            except asyncio.TimeoutError:
+                pass
+            else:
+                # Gom các thay đổi dồn dập thành một lần làm mới
+                await asyncio.sleep(COUNT_MIN_REFRESH_SECONDS)
+            if loop.time() >= full_at:
+                # Làm mới toàn bộ theo lịch cố định, kể cả khi collection liên tục có thay đổi
+                keys = list(self._entries)
+                full_at = loop.time() + COUNT_REFRESH_SECONDS
+            else:
+                keys = list(self._dirty)
+            self._changed.clear()
+            self._dirty.clear()
+            await self._refresh(collection, keys)
+
+    def start(self, collection) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._refresh_loop(collection))
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError, Exception):
+                await self._task
+            self._task = None
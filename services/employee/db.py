@@ -2,6 +2,8 @@ import os
 from pathlib import Path
 from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
+from pymongo import read_preferences
+from monitoring import CommandMetricsListener, PoolMetricsListener
 
 # Load .env file
 load_dotenv()  # cố gắng load mặc định
@@ -18,11 +20,75 @@ except (IndexError, OSError):
 # Lấy URI từ biến môi trường MONGODB_URI
 MONGODB_URI = os.getenv("MONGODB_URI")
 
+# Cấu hình connection pool qua biến môi trường; không đặt thì dùng mặc định của driver
+_POOL_OPTIONS = {
+    "maxPoolSize": "MONGODB_MAX_POOL_SIZE",
+    "minPoolSize": "MONGODB_MIN_POOL_SIZE",
+    "maxIdleTimeMS": "MONGODB_MAX_IDLE_TIME_MS",
+    "waitQueueTimeoutMS": "MONGODB_WAIT_QUEUE_TIMEOUT_MS",
+    "serverSelectionTimeoutMS": "MONGODB_SERVER_SELECTION_TIMEOUT_MS",
+}
+
+
+def pool_options() -> dict:
+    """Motor client keyword arguments for the pool settings present in the environment"""
+    return {option: int(os.environ[env]) for option, env in _POOL_OPTIONS.items() if os.getenv(env)}
+
+
 if not MONGODB_URI:
     # Still create a client placeholder to avoid import errors; will fail on use
     client = None  # type: ignore
     db = None  # type: ignore
 else:
-    client = AsyncIOMotorClient(MONGODB_URI)
+    client = AsyncIOMotorClient(
+        MONGODB_URI,
+        event_listeners=[PoolMetricsListener(), CommandMetricsListener()],
+        **pool_options(),
+    )
     # Chọn database theo nhu cầu; mặc định dùng 'test'
     db = client[os.getenv("MONGODB_DB", "TPExpress")]
+
+
+# Read preference cho các route đọc dữ liệu tham chiếu (Customer, Driver, ...), chấp nhận trễ nhẹ
+# để chia tải đọc sang secondary và dành primary cho ghi Order. maxStalenessSeconds tối thiểu là 90
+REFERENCE_READ_PREFERENCE = os.getenv("MONGODB_REFERENCE_READ_PREFERENCE", "secondaryPreferred")
+REFERENCE_MAX_STALENESS_SECONDS = int(os.getenv("MONGODB_REFERENCE_MAX_STALENESS_SECONDS", "90"))
+
+_READ_PREFERENCES = {
+    "primary": read_preferences.Primary,
+    "primaryPreferred": read_preferences.PrimaryPreferred,
+    "secondary": read_preferences.Secondary,
+    "secondaryPreferred": read_preferences.SecondaryPreferred,
+    "nearest": read_preferences.Nearest,
+}
+
+
+def read_preference(mode: str, max_staleness_seconds: int = -1):
+    """Build a PyMongo read preference from its mode name"""
+    if mode not in _READ_PREFERENCES:
+        raise ValueError(f"Unknown read preference '{mode}'")
+    if mode == "primary":
+        return read_preferences.Primary()
+    return _READ_PREFERENCES[mode](max_staleness=max_staleness_seconds)
+
+
+def reader(name: str, mode: str = "primary", max_staleness_seconds: int = -1):
+    """db[name] reading with the given preference; None when MONGODB_URI is not configured"""
+    if db is None:
+        return None
+    return db[name].with_options(read_preference=read_preference(mode, max_staleness_seconds))
+
+
+# Hedged read (opt-in): read chậm hơn p95 hiện tại sẽ được gửi thêm tới member khác,
+# dùng read preference thay thế (primary <-> secondary). Read của Order khi đó có thể
+# nhận kết quả từ secondary (trễ tối đa REFERENCE_MAX_STALENESS_SECONDS)
+MONGODB_HEDGED_READS = os.getenv("MONGODB_HEDGED_READS", "false").lower() == "true"
+
+
+def hedge_reader(name: str, mode: str = "primary", max_staleness_seconds: int = REFERENCE_MAX_STALENESS_SECONDS):
+    """Collection handle for the hedge of a `mode` read; None when hedging is off"""
+    if db is None or not MONGODB_HEDGED_READS:
+        return None
+    if mode in ("primary", "primaryPreferred"):
+        return reader(name, "secondary", max_staleness_seconds)
+    return reader(name, "primary")
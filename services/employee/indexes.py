@@ -0,0 +1,109 @@
+"""
+Đảm bảo index khai báo trong routes.py tồn tại trên Mongo (chạy lúc startup) và báo cáo
+index thiếu / thừa / không được dùng dựa trên $indexStats
+
+Chạy tay để kiểm tra (exit code 1 nếu thiếu index):
+    python indexes.py
+"""
+
+import asyncio
+import logging
+import os
+import sys
+from typing import Any, Dict, Iterable, List, Tuple
+
+from pymongo import IndexModel
+from pymongo.errors import OperationFailure, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Tắt để không tạo index lúc startup (VD: môi trường chỉ có quyền đọc)
+MONGODB_ENSURE_INDEXES = os.getenv("MONGODB_ENSURE_INDEXES", "true").lower() == "true"
+
+KeySpec = Tuple[Tuple[str, Any], ...]
+
+
+def _spec_key(key: Iterable[Tuple[str, Any]]) -> KeySpec:
+    return tuple((field, direction) for field, direction in key)
+
+
+async def index_report(collection, indexes: Iterable[IndexModel]) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Compare declared indexes with the ones on the server.
+
+    `missing`: declared but absent. `undeclared`: present but not in the spec
+    (candidates for removal). `unused`: present with zero accesses since the
+    server last restarted, according to $indexStats.
+    """
+    declared = {_spec_key(i.document["key"].items()): i.document["name"] for i in indexes}
+    existing = {
+        _spec_key(info["key"]): name
+        for name, info in (await collection.index_information()).items()
+    }
+
+    report: Dict[str, List[Dict[str, Any]]] = {
+        "missing": [{"name": name, "key": list(key)} for key, name in declared.items() if key not in existing],
+        "undeclared": [
+            {"name": name, "key": list(key)}
+            for key, name in existing.items()
+            if key not in declared and name != "_id_"
+        ],
+        "unused": [],
+    }
+
+    try:
+        stats = await collection.aggregate([{"$indexStats": {}}]).to_list(length=None)
+    except OperationFailure as e:
+        logger.warning(f"$indexStats not available on {collection.name}: {e}")
+        return report
+    for stat in stats:
+        accesses = stat.get("accesses", {})
+        if stat.get("name") != "_id_" and accesses.get("ops", 0) == 0:
+            report["unused"].append({"name": stat["name"], "since": str(accesses.get("since"))})
+    return report
+
+
+async def ensure_indexes(collection, indexes: List[IndexModel]) -> None:
+    """Create missing declared indexes, then log the index report for `collection`"""
+    if MONGODB_ENSURE_INDEXES:
+        for index in indexes:
+            # Tạo từng index để một index lỗi (VD: unique nhưng dữ liệu trùng, cùng tên khác
+            # options) không làm hỏng các index còn lại; index đã tồn tại thì bỏ qua
+            try:
+                await collection.create_indexes([index])
+            except PyMongoError as e:
+                logger.error(f"[{collection.name}] failed to create index {index.document['name']}: {e}")
+    try:
+        report = await index_report(collection, indexes)
+    except PyMongoError as e:
+        logger.error(f"[{collection.name}] failed to build index report: {e}")
+        return
+
+    for entry in report["missing"]:
+        logger.warning(f"[{collection.name}] missing index {entry['name']}")
+    for entry in report["undeclared"]:
+        logger.warning(f"[{collection.name}] index {entry['name']} is not declared in the spec")
+    for entry in report["unused"]:
+        logger.info(f"[{collection.name}] index {entry['name']} has no recorded use since {entry['since']}")
+
+
+async def _main() -> int:
+    from db import db
+    import routes
+
+    if db is None:
+        print("MONGODB_URI is not configured")
+        return 1
+    missing = 0
+    for collection, indexes in routes.INDEX_SPECS:
+        report = await index_report(db[collection], indexes)
+        missing += len(report["missing"])
+        print(f"== {collection}")
+        for kind, entries in report.items():
+            for entry in entries:
+                print(f"  {kind:<10} {entry['name']}")
+    return 1 if missing else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main()))
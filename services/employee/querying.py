@@ -0,0 +1,152 @@
+"""
+Filter/sort query language cho list endpoint và query planner đơn giản dựa trên index đã khai báo
+"""
+
+import logging
+import os
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+from pymongo import IndexModel
+
+logger = logging.getLogger(__name__)
+
+# reject: trả 400 cho query phải quét toàn bộ collection; warn: chỉ log cảnh báo
+QUERY_SCAN_POLICY = os.getenv("QUERY_SCAN_POLICY", "reject")
+
+# Query params dành cho pagination/projection, không phải filter
+RESERVED_PARAMS = {"limit", "after", "stream", "fields", "sort"}
+
+SortSpec = List[Tuple[str, int]]
+
+# Kết quả của plan_query
+PLAN_INDEX = "IXSCAN"
+PLAN_SORT = "IXSCAN+SORT"
+PLAN_COLLSCAN = "COLLSCAN"
+
+
+def parse_sort(sort: Optional[str], allowed: Iterable[str]) -> SortSpec:
+    """Parse `sort=-createdAt,status` into [("createdAt", -1), ("status", 1)]"""
+    if not sort:
+        return []
+    allowed = set(allowed)
+    keys: SortSpec = []
+    for token in sort.split(","):
+        token = token.strip()
+        if not token:
+            continue
+        direction = -1 if token.startswith("-") else 1
+        field = token.lstrip("+-")
+        if field not in allowed:
+            raise HTTPException(status_code=400, detail=f"Cannot sort by '{field}'")
+        if field in (k for k, _ in keys):
+            raise HTTPException(status_code=400, detail=f"Duplicate sort field '{field}'")
+        keys.append((field, direction))
+    return keys
+
+
+def parse_filters(params: Mapping[str, str], allowed: Mapping[str, Callable[[str], Any]]) -> Dict[str, Any]:
+    """
+    Translate query params into a Mongo filter.
+
+    `allowed` maps each filterable field to a converter for its raw string
+    value. `field=a` becomes an equality match and `field=a,b` an `$in`.
+    """
+    query: Dict[str, Any] = {}
+    for name, raw in params.items():
+        if name in RESERVED_PARAMS:
+            continue
+        if name not in allowed:
+            raise HTTPException(status_code=400, detail=f"Cannot filter by '{name}'")
+        convert = allowed[name]
+        try:
+            values = [convert(v.strip()) for v in raw.split(",") if v.strip()]
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail=f"Invalid value for '{name}'")
+        if not values:
+            continue
+        query[name] = values[0] if len(values) == 1 else {"$in": values}
+    return query
+
+
+def tiebreak(sort: SortSpec) -> SortSpec:
+    """Append `_id` so the sort order is total (required for keyset cursors)"""
+    if sort and sort[-1][0] == "_id":
+        return list(sort)
+    direction = sort[-1][1] if sort else 1
+    return [k for k in sort if k[0] != "_id"] + [("_id", direction)]
+
+
+def _index_keys(index: IndexModel) -> SortSpec:
+    return list(index.document["key"].items())
+
+
+def _usable(index: IndexModel, filters: Mapping[str, Any]) -> bool:
+    # Index partial chỉ phục vụ query mà filter kéo theo partialFilterExpression: ở đây yêu cầu mỗi field
+    # trong điều kiện được filter (equality/$in, converter của filter cho đúng kiểu mà điều kiện đòi hỏi)
+    partial = index.document.get("partialFilterExpression")
+    return not partial or all(f in filters for f in partial)
+
+
+def _matches_order(keys: Sequence[Tuple[str, Any]], sort: SortSpec) -> bool:
+    if len(keys) < len(sort):
+        return False
+    head = keys[: len(sort)]
+    if [k for k, _ in head] != [k for k, _ in sort]:
+        return False
+    same = all(d == s for (_, d), (_, s) in zip(head, sort))
+    reverse = all(d == -s for (_, d), (_, s) in zip(head, sort))
+    return same or reverse
+
+
+def plan_query(filters: Mapping[str, Any], sort: SortSpec, indexes: Iterable[IndexModel]) -> str:
+    """
+    Decide how Mongo can serve `filters` + `sort` with the declared indexes.
+
+    Follows the equality-sort rule: an index fully serves the query when its
+    leading keys are equality fields and the following keys match the
+    (tie-broken) sort order, or when it is unique and every key is matched by
+    equality. Equality fields the index does not lead with are applied as a
+    residual filter on the fetched documents. An index whose first key is
+    filtered but whose remaining keys do not match the sort still avoids a
+    collection scan but leaves an in-memory sort. Partial indexes are only
+    considered when the filters select documents inside them.
+    """
+    equality = set(filters)
+    order = tiebreak(sort)
+    plan = PLAN_COLLSCAN
+    candidates = [([("_id", 1)], True)] + [
+        (_index_keys(i), bool(i.document.get("unique"))) for i in indexes if _usable(i, filters)
+    ]
+    for keys, unique in candidates:
+        fields = [k for k, _ in keys]
+        if unique and set(fields) <= equality:
+            # Tối đa một document khớp, không cần quan tâm thứ tự
+            return PLAN_INDEX
+        if equality and fields[0] not in equality:
+            continue
+        prefix = 0
+        while prefix < len(fields) and fields[prefix] in equality:
+            prefix += 1
+        # Field equality không nằm trong prefix chỉ là filter phụ, không ảnh hưởng thứ tự
+        if _matches_order(keys[prefix:], order):
+            return PLAN_INDEX
+        if equality:
+            plan = PLAN_SORT
+    return plan
+
+
+def check_plan(filters: Mapping[str, Any], sort: SortSpec, indexes: Iterable[IndexModel]) -> str:
+    """Run plan_query and apply QUERY_SCAN_POLICY to the result"""
+    plan = plan_query(filters, sort, indexes)
+    shape = {"filter": sorted(filters), "sort": sort}
+    if plan == PLAN_COLLSCAN:
+        if QUERY_SCAN_POLICY == "reject":
+            raise HTTPException(
+                status_code=400,
+                detail="Query is not supported by any index (would scan the whole collection)",
+            )
+        logger.warning("Query %s is not supported by any index", shape)
+    elif plan == PLAN_SORT:
+        logger.warning("Query %s needs an in-memory sort", shape)
+    return plan
@@ -1,25 +1,160 @@
-from fastapi import APIRouter, HTTPException
-from db import db
+import asyncio
+from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Request, Body, Query
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from db import REFERENCE_MAX_STALENESS_SECONDS, REFERENCE_READ_PREFERENCE, db, hedge_reader, reader
+from changes import CollectionVersion, CollectionWatcher
+from counting import CountCache
+from indexes import ensure_indexes
+from listing import DEFAULT_PAGE_SIZE, batch_get, count_documents, list_documents
+from loader import BatchLoader, parse_id
+from sharedcache import open_response_cache
+from serialization import BSONJSONResponse
 
 router = APIRouter()
 
+# Các field client được phép chọn qua ?fields= (projection đẩy xuống Mongo)
+EMPLOYEE_FIELDS = {
+    "employeeId",
+    "name",
+    "email",
+    "phone",
+    "position",
+    "department",
+    "createdAt",
+    "updatedAt",
+}
+
+# Field được phép filter (?field=value hoặc ?field=a,b) và hàm chuyển kiểu giá trị
+EMPLOYEE_FILTERS = {
+    "employeeId": str,
+    "email": str,
+    "department": str,
+    "position": str,
+}
+
+# Index khai báo cho collection: được tạo lúc startup (indexes.ensure_indexes) và query planner
+# dựa vào đây để từ chối query quét toàn bộ collection. TTL: IndexModel(..., expireAfterSeconds=N)
+EMPLOYEE_INDEXES = [
+    IndexModel([("employeeId", ASCENDING)], unique=True),
+    # Field không bắt buộc: unique chỉ áp dụng cho document có giá trị (thiếu/null thì không vào index)
+    IndexModel([("email", ASCENDING)], unique=True, partialFilterExpression={"email": {"$type": "string"}}),
+    IndexModel([("department", ASCENDING), ("_id", ASCENDING)]),
+    IndexModel([("position", ASCENDING), ("_id", ASCENDING)]),
+    IndexModel([("updatedAt", DESCENDING)]),
+]
+
+# (collection, index spec) của service, dùng cho startup và `python indexes.py`
+INDEX_SPECS = [("Employee", EMPLOYEE_INDEXES)]
+
+# Deadline (ms) riêng cho từng route (theo path template); route khác dùng REQUEST_DEADLINE_MS
+ROUTE_DEADLINES_MS = {
+    "/employee/{employee_id}": 2000,
+    "/employee:batchGet": 3000,
+    "/employee/count": 3000,
+}
+
+# Dữ liệu tham chiếu chấp nhận trễ nhẹ: đọc theo read preference riêng (trang list có cache/ETag
+# vẫn chờ secondary theo kịp change stream trước khi đọc, xem list_documents)
+employee_reads = reader("Employee", REFERENCE_READ_PREFERENCE, REFERENCE_MAX_STALENESS_SECONDS)
+# Collection dùng cho hedged read (None nếu MONGODB_HEDGED_READS tắt)
+employee_hedge = hedge_reader("Employee", REFERENCE_READ_PREFERENCE)
+
+# Change stream của collection: invalidate cache, cập nhật version token cho ETag và làm mới count
+employee_watcher = CollectionWatcher("employee")
+employee_version = CollectionVersion(employee_watcher)
+employee_counts = CountCache("employee", employee_watcher)
+
+# Dữ liệu tham chiếu, đọc nhiều: cache response (dùng chung giữa các worker nếu RESPONSE_CACHE_SHARED)
+employee_cache = open_response_cache("employee")
+employee_watcher.subscribe(employee_cache.on_change)
+
+# Gộp các lookup theo id đồng thời thành một query $in
+employee_loader = BatchLoader("employee", employee_reads, hedge_collection=employee_hedge) if db is not None else None
+
+_index_task: Optional[asyncio.Future] = None
+
+
+@router.on_event("startup")
+async def _start_change_watcher():
+    if db is not None:
+        employee_watcher.start(db.Employee)
+        employee_counts.start(employee_reads)
+
+
+@router.on_event("startup")
+async def _ensure_indexes():
+    global _index_task
+    if db is not None:
+        # Chạy nền để việc build index trên collection lớn không chặn readiness
+        _index_task = asyncio.gather(*(ensure_indexes(db[name], spec) for name, spec in INDEX_SPECS))
+
+
+@router.on_event("shutdown")
+async def _stop_change_watcher():
+    await employee_watcher.stop()
+    await employee_counts.stop()
+
 
 @router.get("/employee")
-async def get_orders():
+async def get_orders(
+    request: Request,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1),
+    after: Optional[str] = Query(None, description="Cursor `next` của trang trước"),
+    stream: bool = Query(False, description="Trả về NDJSON stream toàn bộ collection"),
+    fields: Optional[str] = Query(None, description="Danh sách field, phân cách bằng dấu phẩy"),
+    sort: Optional[str] = Query(None, description="VD: -createdAt (dấu - là giảm dần)"),
+):
+    if db is None:
+        raise HTTPException(status_code=500, detail="MONGODB_URI is not configured")
+    return await list_documents(
+        request,
+        employee_reads,
+        limit=limit,
+        after=after,
+        stream=stream,
+        fields=fields,
+        sort=sort,
+        allowed_fields=EMPLOYEE_FIELDS,
+        filters=EMPLOYEE_FILTERS,
+        indexes=EMPLOYEE_INDEXES,
+        cache=employee_cache,
+        version=employee_version,
+        hedge=employee_hedge,
+    )
+
+
+@router.get("/employee/count")
+async def count_employee(request: Request):
+    if db is None:
+        raise HTTPException(status_code=500, detail="MONGODB_URI is not configured")
+    return await count_documents(request, employee_reads, employee_counts, EMPLOYEE_FILTERS, EMPLOYEE_INDEXES)
+
+
+@router.post("/employee:batchGet")
+async def batch_get_employee(ids: List[str] = Body(..., embed=True)):
+    if db is None:
+        raise HTTPException(status_code=500, detail="MONGODB_URI is not configured")
+    return await batch_get(employee_loader, ids)
+
+
+# Route /employee/{id} để cuối cùng: các route GET /employee/<tên> cố định phải khai báo phía trên
+@router.get("/employee/{employee_id}")
+async def get_employee_by_id(employee_id: str):
     if db is None:
         raise HTTPException(status_code=500, detail="MONGODB_URI is not configured")
-    docs = await db.Employee.find().to_list(length=None)
-    for d in docs:
-        if "_id" in d:
-            d["_id"] = str(d["_id"])  # serialize ObjectId
-    return docs
+    doc = await employee_loader.load(parse_id(employee_id))
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Employee not found")
+    return BSONJSONResponse(content=doc)
     
 
 # uvicorn main:app --reload --host 0.0.0.0 --port 8000
 
 # Prometheus metrics
 from fastapi.responses import Response
-from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import Counter, Histogram
+from exposition import CONTENT_TYPE_LATEST, metrics_exposition
 
 # Metrics definitions
 http_requests_total = Counter('http_requests_total', 'Total HTTP requests', ['method', 'endpoint', 'status'])
@@ -28,5 +163,5 @@ http_request_duration_seconds = Histogram('http_request_duration_seconds', 'HTTP
 @router.get("/metrics")
 async def metrics():
     """Prometheus metrics endpoint"""
-    data = generate_latest()
+    data = await metrics_exposition()
     return Response(content=data, media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,237 @@
+"""
+Middleware ASGI nén response theo Accept-Encoding (zstd, br, gzip): bỏ qua body nhỏ hơn ngưỡng,
+nén từng chunk với StreamingResponse (VD: NDJSON của ?stream=true)
+"""
+
+import os
+import time
+import zlib
+from typing import Callable, Dict, List, Optional
+
+from prometheus_client import Counter
+
+# brotli / zstandard là tuỳ chọn: thiếu thư viện thì encoding tương ứng không được đề xuất
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Body nhỏ hơn ngưỡng (byte) được gửi nguyên; thứ tự ưu tiên khi client chấp nhận như nhau
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+COMPRESSION_ENCODINGS = [
+    e.strip() for e in os.getenv("COMPRESSION_ENCODINGS", "zstd,br,gzip").split(",") if e.strip()
+]
+# Mức nén thấp: response sinh theo request nên ưu tiên CPU hơn tỉ lệ nén
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "5"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+COMPRESSION_ZSTD_LEVEL = int(os.getenv("COMPRESSION_ZSTD_LEVEL", "3"))
+
+http_compression_responses_total = Counter(
+    'http_compression_responses_total', 'Responses by content encoding chosen', ['encoding']
+)
+http_compression_bytes_in_total = Counter(
+    'http_compression_bytes_in_total', 'Response bytes before compression', ['encoding']
+)
+http_compression_bytes_out_total = Counter(
+    'http_compression_bytes_out_total', 'Response bytes after compression', ['encoding']
+)
+http_compression_bytes_saved_total = Counter(
+    'http_compression_bytes_saved_total', 'Response bytes saved by compression', ['encoding']
+)
+http_compression_cpu_seconds_total = Counter(
+    'http_compression_cpu_seconds_total', 'CPU time spent compressing responses', ['encoding']
+)
+
+
+class _Gzip:
+    def __init__(self):
+        self._z = zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._z.compress(data)
+
+    def flush(self) -> bytes:
+        return self._z.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._z.flush()
+
+
+class _Brotli:
+    def __init__(self):
+        self._c = brotli.Compressor(quality=COMPRESSION_BROTLI_QUALITY)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._c.process(data)
+
+    def flush(self) -> bytes:
+        return self._c.flush()
+
+    def finish(self) -> bytes:
+        return self._c.finish()
+
+
+class _Zstd:
+    def __init__(self):
+        self._c = zstandard.ZstdCompressor(level=COMPRESSION_ZSTD_LEVEL).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._c.compress(data)
+
+    def flush(self) -> bytes:
+        return self._c.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self._c.flush()
+
+
+COMPRESSORS: Dict[str, Callable] = {"gzip": _Gzip}
+if brotli is not None:
+    COMPRESSORS["br"] = _Brotli
+if zstandard is not None:
+    COMPRESSORS["zstd"] = _Zstd
+
+
+def negotiate(accept_encoding: str, available: List[str]) -> Optional[str]:
+    """Pick the encoding with the highest q-value in `accept_encoding`; ties go to `available` order"""
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[token] = q
+    best, best_q = None, 0.0
+    for encoding in available:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+class _Encoder:
+    """One compressor plus the byte and CPU accounting for one response"""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        self._compressor = COMPRESSORS[encoding]()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cpu = 0.0
+
+    def _run(self, fn, *args) -> bytes:
+        started = time.thread_time()
+        out = fn(*args)
+        self.cpu += time.thread_time() - started
+        self.bytes_out += len(out)
+        return out
+
+    def chunk(self, data: bytes, last: bool) -> bytes:
+        self.bytes_in += len(data)
+        out = self._run(self._compressor.compress, data)
+        # Chunk giữa stream được flush để client nhận được ngay, không đợi đầy block
+        return out + self._run(self._compressor.finish if last else self._compressor.flush)
+
+    def report(self) -> None:
+        http_compression_responses_total.labels(encoding=self.encoding).inc()
+        http_compression_bytes_in_total.labels(encoding=self.encoding).inc(self.bytes_in)
+        http_compression_bytes_out_total.labels(encoding=self.encoding).inc(self.bytes_out)
+        http_compression_bytes_saved_total.labels(encoding=self.encoding).inc(max(self.bytes_in - self.bytes_out, 0))
+        http_compression_cpu_seconds_total.labels(encoding=self.encoding).inc(self.cpu)
+
+
+def _add_vary(headers: List) -> None:
+    for i, (name, value) in enumerate(headers):
+        if name.lower() == b"vary":
+            if b"accept-encoding" not in value.lower():
+                headers[i] = (name, value + b", Accept-Encoding")
+            return
+    headers.append((b"vary", b"Accept-Encoding"))
+
+
+class CompressionMiddleware:
+    """
+    Compress response bodies with the best encoding the client accepts.
+
+    A single-message body smaller than `minimum_size` is sent as is. A
+    streamed body (more_body=True) is compressed chunk by chunk and loses its
+    Content-Length. Strong ETags become weak, since the bytes differ from the
+    identity representation they were computed for.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_BYTES, encodings: Optional[List[str]] = None):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.encodings = [e for e in (encodings or COMPRESSION_ENCODINGS) if e in COMPRESSORS]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept = ""
+        for name, value in scope.get("headers", []):
+            if name == b"accept-encoding":
+                accept = value.decode("latin-1")
+                break
+        encoding = negotiate(accept, self.encodings) if accept else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[dict] = None
+        encoder: Optional[_Encoder] = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start, encoder, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more = message.get("more_body", False)
+            if encoder is None:
+                headers = list(start.get("headers", []))
+                already = any(name.lower() == b"content-encoding" for name, _ in headers)
+                if already or (not more and len(body) < self.minimum_size):
+                    passthrough = True
+                    if not already:
+                        _add_vary(headers)
+                    await send({**start, "headers": headers})
+                    await send(message)
+                    http_compression_responses_total.labels(encoding="identity").inc()
+                    return
+                encoder = _Encoder(encoding)
+                payload = encoder.chunk(body, last=not more)
+                headers = [(n, v) for n, v in headers if n.lower() != b"content-length"]
+                headers.append((b"content-encoding", encoding.encode()))
+                if not more:
+                    headers.append((b"content-length", str(len(payload)).encode()))
+                headers = [
+                    (n, b"W/" + v if n.lower() == b"etag" and not v.startswith(b"W/") else v)
+                    for n, v in headers
+                ]
+                _add_vary(headers)
+                await send({**start, "headers": headers})
+            else:
+                payload = encoder.chunk(body, last=not more)
+            await send({"type": "http.response.body", "body": payload, "more_body": more})
+            if not more:
+                encoder.report()
+
+        await self.app(scope, receive, send_compressed)
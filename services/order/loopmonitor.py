@@ -0,0 +1,116 @@
+"""
+Theo dõi event loop của worker: đo độ trễ lập lịch liên tục (histogram) và ghi log stack của
+callback đang chặn loop quá ngưỡng. Chi phí thấp để bật thường trực: một task ngủ theo chu kỳ
+và một thread watchdog chỉ thức dậy mỗi chu kỳ, không dùng asyncio debug mode
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+
+from prometheus_client import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR_ENABLED", "true").lower() == "true"
+# Chu kỳ đo (ms): độ trễ = thời gian ngủ thực tế trừ chu kỳ
+LOOP_MONITOR_INTERVAL_MS = float(os.getenv("LOOP_MONITOR_INTERVAL_MS", "100"))
+# Loop bị chặn lâu hơn ngưỡng này (ms) thì ghi log stack của callback đang chạy
+LOOP_MONITOR_BLOCK_MS = float(os.getenv("LOOP_MONITOR_BLOCK_MS", "250"))
+
+event_loop_lag_seconds = Histogram(
+    'event_loop_lag_seconds', 'Delay between when a loop callback was due and when it ran',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+event_loop_blocked_total = Counter(
+    'event_loop_blocked_total', 'Times the event loop was blocked longer than LOOP_MONITOR_BLOCK_MS'
+)
+
+
+class LoopMonitor:
+    """
+    Measure event loop lag and report callbacks that block the loop.
+
+    A task sleeps `interval_ms` at a time and records how late it wakes up.
+    Each wake-up is also a heartbeat for a watchdog thread: when no heartbeat
+    arrives for `block_ms` past the interval, the watchdog logs the loop
+    thread's current stack (the blocking callback) once per blocked episode.
+    """
+
+    def __init__(self, interval_ms: float = LOOP_MONITOR_INTERVAL_MS, block_ms: float = LOOP_MONITOR_BLOCK_MS):
+        self.interval = interval_ms / 1000
+        self.block = block_ms / 1000
+        self._heartbeat = time.monotonic()
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        """Start measuring the running loop (call from the loop thread)"""
+        if self._task is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._measure())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-monitor", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._stopped.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._watchdog.join(timeout=self.interval * 2)
+        self._watchdog = None
+
+    async def _measure(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            due = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            event_loop_lag_seconds.observe(max(0.0, loop.time() - due))
+            self._heartbeat = time.monotonic()
+
+    def _watch(self) -> None:
+        reported = False
+        while not self._stopped.wait(self.interval):
+            blocked = time.monotonic() - self._heartbeat - self.interval
+            if blocked < self.block:
+                reported = False
+                continue
+            if reported:
+                continue
+            # Chỉ báo một lần cho mỗi đợt bị chặn; độ dài đầy đủ nằm trong histogram độ trễ
+            reported = True
+            event_loop_blocked_total.inc()
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "<unavailable>\n"
+            logger.warning(
+                f"Event loop blocked for at least {blocked * 1000:.0f} ms, loop thread stack:\n{stack}"
+            )
+
+
+def install_loop_monitor(app, monitor: Optional[LoopMonitor] = None) -> Optional[LoopMonitor]:
+    """Run a LoopMonitor for the lifetime of `app` (one per worker process); no-op when disabled"""
+    if not LOOP_MONITOR_ENABLED:
+        return None
+    monitor = monitor or LoopMonitor()
+
+    async def start_monitor():
+        monitor.start()
+
+    app.add_event_handler("startup", start_monitor)
+    app.add_event_handler("shutdown", monitor.stop)
+    return monitor
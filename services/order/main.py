@@ -1,6 +1,10 @@
-from fastapi import FastAPI, Request
-from routes import router
-from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from fastapi import FastAPI
+from routes import ROUTE_DEADLINES_MS, router
+from compression import CompressionMiddleware
+from deadline import DeadlineMiddleware
+from middleware import MetricsMiddleware
+from loopmonitor import install_loop_monitor
+from exposition import CONTENT_TYPE_LATEST, metrics_exposition
 import time
 import os
 import sys
@@ -8,15 +12,7 @@ import asyncio
 
 # Add kafka directory to path
 sys.path.append(os.path.join(os.path.dirname(__file__), '../../kafka'))
-from producer import KafkaProducer, send_metric, send_log, send_health_check
-
-# Prometheus metrics (service-scoped names to avoid duplicates)
-order_http_requests_total = Counter(
-    'order_http_requests_total', 'Total HTTP requests (order)', ['method', 'endpoint', 'status']
-)
-order_http_request_duration_seconds = Histogram(
-    'order_http_request_duration_seconds', 'HTTP request duration (order)', ['method', 'endpoint']
-)
+from producer import get_kafka_producer, increment_metric, observe_metric, send_log, send_health_check
 
 # Tạo FastAPI app
 app = FastAPI(
@@ -25,44 +21,30 @@ app = FastAPI(
     version="1.0.0"
 )
 
-# Kafka Producer
-kafka_producer = KafkaProducer("order")
+# Nén response (zstd/br/gzip theo Accept-Encoding), bỏ qua body nhỏ
+app.add_middleware(CompressionMiddleware)
+# Deadline cho từng request: quá hạn thì huỷ handler (kèm query Mongo) và trả 504
+app.add_middleware(DeadlineMiddleware, routes=ROUTE_DEADLINES_MS)
 
-# Middleware để track HTTP requests
-@app.middleware("http")
-async def track_requests(request: Request, call_next):
-    start_time = time.time()
-    
-    # Process request
-    response = await call_next(request)
-    
-    # Calculate duration
-    duration = time.time() - start_time
-    
-    # Extract metrics
-    method = request.method
-    endpoint = request.url.path
-    status = str(response.status_code)
-    
-    # Update metrics
-    order_http_requests_total.labels(method=method, endpoint=endpoint, status=status).inc()
-    order_http_request_duration_seconds.labels(method=method, endpoint=endpoint).observe(duration)
-    
-    # Send metrics to Kafka
-    try:
-        await send_metric("order", "http_requests_total", 1, {
-            "method": method,
-            "endpoint": endpoint,
-            "status": status
-        })
-        await send_metric("order", "http_request_duration_seconds", duration, {
-            "method": method,
-            "endpoint": endpoint
-        })
-    except Exception as e:
-        print(f"Failed to send metrics to Kafka: {e}")
-    
-    return response
+# Kafka Producer (cùng instance với các hàm send_*/increment_metric bên dưới)
+kafka_producer = get_kafka_producer("order")
+
+def _record_request_metrics(method: str, endpoint: str, status: str, duration: float):
+    """Aggregate request metrics; the producer flushes one snapshot per interval to Kafka"""
+    increment_metric("order", "http_requests_total", 1, {
+        "method": method,
+        "endpoint": endpoint,
+        "status": status
+    })
+    observe_metric("order", "http_request_duration_seconds", duration, {
+        "method": method,
+        "endpoint": endpoint
+    })
+
+# Đếm và đo thời gian request theo route template (ngoài cùng: tính cả nén và 504 do deadline)
+app.add_middleware(MetricsMiddleware, prefix="order", observer=_record_request_metrics)
+# Đo độ trễ event loop, ghi log stack khi một callback chặn loop quá ngưỡng
+install_loop_monitor(app)
 
 # Đăng ký routes KHÔNG cần API key
 app.include_router(router)
@@ -84,7 +66,7 @@ async def health_check():
 async def metrics():
     """Prometheus metrics endpoint - không yêu cầu API key"""
     from fastapi import Response
-    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+    return Response(await metrics_exposition(), media_type=CONTENT_TYPE_LATEST)
 
 @app.on_event("startup")
 async def startup_event():
@@ -0,0 +1,435 @@
+"""
+Read model OrderView: mỗi order kèm sẵn thông tin customer / driver / vehicle để hiển thị,
+được cập nhật theo batch (bulk_write) từ event trên order.events và change stream của
+Customer, Driver, Vehicle (cùng database với Order). Change stream của entity chỉ chạy ở một
+process trong cả group (lease trong OrderViewCheckpoint), resume token được lưu ở đó
+
+Dựng lại toàn bộ từ collection Order:
+    python projector.py rebuild
+"""
+
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import socket
+import sys
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from aiokafka import AIOKafkaConsumer
+from aiokafka.errors import KafkaError
+from prometheus_client import Counter, Histogram
+from pymongo import ASCENDING, DESCENDING, DeleteOne, IndexModel, ReturnDocument, UpdateMany, UpdateOne
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from changes import CollectionWatcher
+
+logger = logging.getLogger(__name__)
+
+VIEW_COLLECTION = "OrderView"
+# Lease của process đang chạy change stream entity và resume token của từng stream
+CHECKPOINT_COLLECTION = "OrderViewCheckpoint"
+_LEASE_ID = "entities"
+
+ORDER_VIEW_GROUP = os.getenv("ORDER_VIEW_GROUP", "order-view")
+# Số event / thay đổi tối đa gộp vào một bulk_write và thời gian gom (giây)
+ORDER_VIEW_BATCH_SIZE = int(os.getenv("ORDER_VIEW_BATCH_SIZE", "500"))
+ORDER_VIEW_FLUSH_SECONDS = float(os.getenv("ORDER_VIEW_FLUSH_SECONDS", "0.5"))
+# Lease hết hạn sau chừng này giây nếu process giữ nó không gia hạn (chết / mất kết nối Mongo)
+ORDER_VIEW_LEASE_SECONDS = float(os.getenv("ORDER_VIEW_LEASE_SECONDS", "30"))
+# Batch order ghi lỗi được thử lại; thời gian chờ (giây) tăng gấp đôi mỗi lần, tới giá trị tối đa
+ORDER_VIEW_RETRY_SECONDS = float(os.getenv("ORDER_VIEW_RETRY_SECONDS", "1"))
+ORDER_VIEW_RETRY_MAX_SECONDS = float(os.getenv("ORDER_VIEW_RETRY_MAX_SECONDS", "30"))
+
+# Field nhúng: tên field trong OrderView -> (collection, khoá nghiệp vụ trên Order, field cần hiển thị)
+EMBEDDED = {
+    "customer": ("Customer", "customerId", ("customerId", "name", "phone", "email", "address")),
+    "driver": ("Driver", "driverId", ("driverId", "name", "phone", "licenseNumber", "status")),
+    "vehicle": ("Vehicle", "vehicleId", ("vehicleId", "plateNumber", "type", "capacity", "status")),
+}
+
+# _id của OrderView là orderId, nên tra cứu một order là một point read trên _id
+ORDER_VIEW_INDEXES = [
+    IndexModel([("orderId", ASCENDING)], unique=True),
+    IndexModel([("status", ASCENDING), ("createdAt", DESCENDING), ("_id", DESCENDING)]),
+    IndexModel([("customerId", ASCENDING), ("createdAt", DESCENDING), ("_id", DESCENDING)]),
+    IndexModel([("driverId", ASCENDING), ("createdAt", DESCENDING), ("_id", DESCENDING)]),
+    IndexModel([("vehicleId", ASCENDING), ("createdAt", DESCENDING), ("_id", DESCENDING)]),
+    IndexModel([("createdAt", DESCENDING), ("_id", DESCENDING)]),
+]
+
+order_view_writes_total = Counter(
+    'order_view_writes_total', 'OrderView documents written by the projector', ['source', 'op']
+)
+order_view_batch_size = Histogram(
+    'order_view_batch_size', 'Changes folded into one OrderView bulk_write', ['source'],
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+)
+
+
+def _embed(doc: Optional[Dict[str, Any]], fields: Iterable[str]) -> Optional[Dict[str, Any]]:
+    if doc is None:
+        return None
+    return {f: doc[f] for f in fields if f in doc}
+
+
+def _newer(name: str, version) -> Dict[str, Any]:
+    """Filter for view documents whose `name` copy was read before `version` (cluster time)"""
+    if version is None:
+        return {}
+    return {"$or": [
+        {f"embeddedAt.{name}": {"$lt": version}},
+        {f"embeddedAt.{name}": {"$exists": False}},
+    ]}
+
+
+def _embed_update(name: str, doc: Optional[Dict[str, Any]], fields: Iterable[str], version) -> Dict[str, Any]:
+    update = {name: _embed(doc, fields)}
+    if version is not None:
+        update[f"embeddedAt.{name}"] = version
+    return {"$set": update}
+
+
+class OrderProjector:
+    """
+    Keep OrderView in sync with Order and the entities it references.
+
+    Order events only say which orders changed: each batch re-reads those
+    orders and their customers, drivers and vehicles (one $in query per
+    collection) and rewrites the view documents, so replays are harmless.
+    An entity change rewrites its embedded copy in every order that
+    references it with one UpdateMany per entity.
+
+    Both paths write an embedded copy only if it was read at a later cluster
+    time than the copy in place (`embeddedAt`), so an order batch cannot
+    overwrite a newer copy written by the entity path, whatever order the
+    two writes land in. The entity change streams run in a single process of
+    the group, the holder of a lease in OrderViewCheckpoint, which also keeps
+    each stream's resume token once its changes are applied: a new holder
+    (or a reopened stream) continues where the last one stopped, and when
+    that is impossible every entity is projected again. Order event offsets
+    are committed after their batch is written; a failed batch is retried
+    with backoff before more events are fetched.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.client = db.client
+        self.orders = db.Order
+        self.view = db[VIEW_COLLECTION]
+        self.checkpoints = db[CHECKPOINT_COLLECTION]
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.leading = False
+        self._consumer: Optional[AIOKafkaConsumer] = None
+        self._tasks: List[asyncio.Task] = []
+        self._entity_task: Optional[asyncio.Task] = None
+        self._watchers: Dict[str, CollectionWatcher] = {}
+        self._changed: Dict[str, Set[Any]] = {name: set() for name in EMBEDDED}
+        # Stream mở mà không tiếp tục được từ token: phải chiếu lại toàn bộ entity
+        self._resync: Set[str] = set()
+        self._tokens: Dict[str, Any] = {}
+        self._entity_event = asyncio.Event()
+
+    async def _read(self, collection: str, query: Dict[str, Any], fields: Iterable[str]) -> Tuple[List[Dict[str, Any]], Any]:
+        """Documents matching `query` and the cluster time they were read at (None without replica set)"""
+        async with await self.client.start_session(causal_consistency=False) as session:
+            docs = await self.db[collection].find(query, list(fields), session=session).to_list(length=None)
+            return docs, session.operation_time
+
+    async def project_orders(self, order_ids: Iterable[str], source: str = "order") -> None:
+        """Rebuild the view documents of `order_ids` from the source collections"""
+        order_ids = list(set(order_ids))
+        if not order_ids:
+            return
+        orders = await self.orders.find({"orderId": {"$in": order_ids}}).to_list(length=None)
+        entities: Dict[str, Dict[Any, Dict[str, Any]]] = {}
+        versions: Dict[str, Any] = {}
+        for name, (collection, key, fields) in EMBEDDED.items():
+            keys = list({o[key] for o in orders if o.get(key) is not None})
+            docs, versions[name] = await self._read(collection, {key: {"$in": keys}}, fields) if keys else ([], None)
+            entities[name] = {d[key]: d for d in docs}
+        # Field đã bị xoá khỏi order cũng phải bỏ khỏi view
+        existing = {
+            d["_id"]: d
+            for d in await self.view.find(
+                {"_id": {"$in": order_ids}}, {name: 0 for name in EMBEDDED}
+            ).to_list(length=None)
+        }
+
+        now = datetime.now(timezone.utc)
+        ops: List[Any] = []
+        found = set()
+        for order in orders:
+            order_id = str(order["orderId"])
+            found.add(order_id)
+            view = {k: v for k, v in order.items() if k != "_id"}
+            view["projectedAt"] = now
+            update: Dict[str, Any] = {"$set": view}
+            stale = set(existing.get(order_id, {})) - set(view) - {"_id", "embeddedAt"}
+            if stale:
+                update["$unset"] = {f: "" for f in stale}
+            ops.append(UpdateOne({"_id": order_id}, update, upsert=True))
+            for name, (_, key, fields) in EMBEDDED.items():
+                # Bản nhúng của entity khác (order đổi driver...) luôn được thay, bất kể version
+                condition = _newer(name, versions[name])
+                if condition:
+                    condition["$or"].append({f"{name}.{key}": {"$ne": order.get(key)}})
+                ops.append(UpdateOne(
+                    {"_id": order_id, **condition},
+                    _embed_update(name, entities[name].get(order.get(key)), fields, versions[name]),
+                ))
+        # Order đã bị xoá khỏi collection nguồn
+        deleted = [DeleteOne({"_id": order_id}) for order_id in map(str, order_ids) if order_id not in found]
+
+        order_view_batch_size.labels(source=source).observe(len(order_ids))
+        # ordered: bản nhúng chỉ được ghi sau khi document của order đã có
+        await self.view.bulk_write(ops + deleted, ordered=True)
+        order_view_writes_total.labels(source=source, op="replace").inc(len(found))
+        order_view_writes_total.labels(source=source, op="delete").inc(len(deleted))
+
+    def _on_entity_change(self, name: str, event: Optional[Dict[str, Any]]) -> None:
+        if event is None:
+            watcher = self._watchers.get(name)
+            if watcher is not None and watcher.live and not watcher.resumed:
+                # Sau khi chiếu lại toàn bộ, stream tiếp tục từ điểm mở này
+                self._resync.add(name)
+                self._tokens[name] = watcher.resume_token
+                self._entity_event.set()
+            return
+        if event.get("operationType") in ("insert", "update", "replace"):
+            self._changed[name].add(event["documentKey"]["_id"])
+        # Token được lưu sau khi các thay đổi tới nó đã được ghi vào OrderView
+        self._tokens[name] = event["_id"]
+        self._entity_event.set()
+
+    async def _write_entities(self, name: str, docs: List[Dict[str, Any]], version) -> None:
+        _, key, fields = EMBEDDED[name]
+        ops = [
+            UpdateMany({key: doc[key], **_newer(name, version)}, _embed_update(name, doc, fields, version))
+            for doc in docs
+            if doc.get(key) is not None
+        ]
+        if ops:
+            await self.view.bulk_write(ops, ordered=False)
+            order_view_writes_total.labels(source=name, op="update").inc(len(ops))
+
+    async def _project_entities(self, name: str, ids: Set[Any]) -> None:
+        collection, _, fields = EMBEDDED[name]
+        docs, version = await self._read(collection, {"_id": {"$in": list(ids)}}, fields)
+        order_view_batch_size.labels(source=name).observe(len(ids))
+        await self._write_entities(name, docs, version)
+
+    async def _project_all_entities(self, name: str) -> None:
+        """Re-embed every entity of `name`, ORDER_VIEW_BATCH_SIZE at a time"""
+        collection, _, fields = EMBEDDED[name]
+        last = None
+        while True:
+            query = {"_id": {"$gt": last}} if last is not None else {}
+            async with await self.client.start_session(causal_consistency=False) as session:
+                docs = await self.db[collection].find(query, list(fields), session=session).sort(
+                    "_id", ASCENDING
+                ).limit(ORDER_VIEW_BATCH_SIZE).to_list(length=ORDER_VIEW_BATCH_SIZE)
+                version = session.operation_time
+            if not docs:
+                return
+            await self._write_entities(name, docs, version)
+            last = docs[-1]["_id"]
+
+    async def _apply_entity_changes(self, name: str, token) -> None:
+        pending = self._changed[name]
+        if name in self._resync:
+            self._resync.discard(name)
+            pending.clear()
+            try:
+                await self._project_all_entities(name)
+            except PyMongoError:
+                self._resync.add(name)
+                raise
+        while pending:
+            batch = set()
+            while pending and len(batch) < ORDER_VIEW_BATCH_SIZE:
+                batch.add(pending.pop())
+            try:
+                await self._project_entities(name, batch)
+            except PyMongoError:
+                pending |= batch
+                raise
+        if token is not None:
+            await self.checkpoints.update_one(
+                {"_id": _LEASE_ID, "owner": self.owner}, {"$set": {f"tokens.{name}": token}}
+            )
+
+    async def _entity_loop(self) -> None:
+        while True:
+            await self._entity_event.wait()
+            # Gom các thay đổi liên tiếp vào một bulk_write
+            await asyncio.sleep(ORDER_VIEW_FLUSH_SECONDS)
+            self._entity_event.clear()
+            tokens = dict(self._tokens)
+            for name in EMBEDDED:
+                try:
+                    await self._apply_entity_changes(name, tokens.get(name))
+                except PyMongoError as e:
+                    # Giữ lại thay đổi và thử lại ở vòng sau
+                    logger.warning(f"OrderView update from {name} changes failed: {e}")
+                    self._entity_event.set()
+
+    async def _acquire_lease(self) -> Optional[Dict[str, Any]]:
+        """Take or renew the entity stream lease; the checkpoint document if held"""
+        now = datetime.now(timezone.utc)
+        try:
+            return await self.checkpoints.find_one_and_update(
+                {"_id": _LEASE_ID, "$or": [{"owner": self.owner}, {"expiresAt": {"$lt": now}}]},
+                {"$set": {"owner": self.owner, "expiresAt": now + timedelta(seconds=ORDER_VIEW_LEASE_SECONDS)}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # Process khác đang giữ lease còn hạn
+            return None
+
+    def _start_entities(self, checkpoint: Dict[str, Any]) -> None:
+        tokens = checkpoint.get("tokens") or {}
+        for name, (collection, _, _) in EMBEDDED.items():
+            watcher = CollectionWatcher(f"{name}-view", resume_token=tokens.get(name))
+            watcher.subscribe(lambda event, name=name: self._on_entity_change(name, event))
+            watcher.start(self.db[collection])
+            self._watchers[name] = watcher
+        self._entity_task = asyncio.create_task(self._entity_loop())
+        self.leading = True
+        logger.info(f"OrderView entity projection started on {self.owner}")
+
+    async def _stop_entities(self) -> None:
+        if self._entity_task is not None:
+            self._entity_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError, Exception):
+                await self._entity_task
+            self._entity_task = None
+        for watcher in self._watchers.values():
+            await watcher.stop()
+        self._watchers = {}
+        for pending in self._changed.values():
+            pending.clear()
+        self._resync.clear()
+        self._tokens.clear()
+        self.leading = False
+
+    async def _lease_loop(self) -> None:
+        while True:
+            try:
+                checkpoint = await self._acquire_lease()
+            except PyMongoError as e:
+                logger.warning(f"OrderView lease renewal failed: {e}")
+                checkpoint = None
+            if checkpoint is not None and not self.leading:
+                self._start_entities(checkpoint)
+            elif checkpoint is None and self.leading:
+                # Mất lease: process khác có thể đã nhận, dừng để không ghi chồng
+                await self._stop_entities()
+            await asyncio.sleep(ORDER_VIEW_LEASE_SECONDS / 3)
+
+    async def _order_loop(self) -> None:
+        while True:
+            records = await self._consumer.getmany(
+                timeout_ms=int(ORDER_VIEW_FLUSH_SECONDS * 1000), max_records=ORDER_VIEW_BATCH_SIZE
+            )
+            order_ids = set()
+            for messages in records.values():
+                for message in messages:
+                    try:
+                        event = json.loads(message.value)
+                    except ValueError:
+                        continue
+                    if isinstance(event, dict) and event.get("orderId"):
+                        order_ids.add(str(event["orderId"]))
+            if not records:
+                continue
+            delay = ORDER_VIEW_RETRY_SECONDS
+            while True:
+                try:
+                    await self.project_orders(order_ids)
+                    break
+                except PyMongoError as e:
+                    # Không lấy thêm event cho tới khi batch ghi được;
+                    # offset chưa commit nên process chết giữa chừng thì batch được giao lại
+                    logger.warning(
+                        f"OrderView projection of {len(order_ids)} orders failed, retrying in {delay:g}s: {e}"
+                    )
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, ORDER_VIEW_RETRY_MAX_SECONDS)
+            try:
+                await self._consumer.commit({tp: messages[-1].offset + 1 for tp, messages in records.items()})
+            except KafkaError as e:
+                # VD: rebalance; batch được giao lại cho consumer khác và ghi lại (ghi lại view là vô hại)
+                logger.warning(f"OrderView offset commit failed: {e}")
+
+    async def rebuild(self) -> int:
+        """Project every order, ORDER_VIEW_BATCH_SIZE at a time; returns the number of orders"""
+        total, last = 0, None
+        while True:
+            query = {"orderId": {"$gt": last}} if last is not None else {"orderId": {"$exists": True}}
+            docs = await self.orders.find(query, {"orderId": 1}).sort("orderId", ASCENDING).limit(
+                ORDER_VIEW_BATCH_SIZE
+            ).to_list(length=ORDER_VIEW_BATCH_SIZE)
+            if not docs:
+                return total
+            await self.project_orders([str(d["orderId"]) for d in docs], source="rebuild")
+            total += len(docs)
+            last = docs[-1]["orderId"]
+
+    async def start(self, bootstrap_servers: str, topic: str) -> None:
+        """Consume `topic` in the ORDER_VIEW_GROUP group; watch the embedded collections while holding the lease"""
+        if self._tasks:
+            return
+        self._tasks.append(asyncio.create_task(self._lease_loop()))
+        consumer = AIOKafkaConsumer(
+            topic,
+            bootstrap_servers=bootstrap_servers,
+            group_id=ORDER_VIEW_GROUP,
+            enable_auto_commit=False,
+            auto_offset_reset="latest",
+        )
+        try:
+            await consumer.start()
+        except Exception as e:
+            logger.warning(f"OrderView consumer not started: {e}")
+            return
+        self._consumer = consumer
+        self._tasks.append(asyncio.create_task(self._order_loop()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError, Exception):
+                await task
+        self._tasks = []
+        if self.leading:
+            await self._stop_entities()
+            # Trả lease ngay để process khác nhận mà không phải chờ hết hạn
+            with contextlib.suppress(PyMongoError):
+                await self.checkpoints.update_one(
+                    {"_id": _LEASE_ID, "owner": self.owner}, {"$set": {"expiresAt": datetime.now(timezone.utc)}}
+                )
+        if self._consumer:
+            with contextlib.suppress(Exception):
+                await self._consumer.stop()
+            self._consumer = None
+
+
+async def _main(argv: List[str]) -> int:
+    from db import db
+
+    if argv[1:] != ["rebuild"]:
+        print("usage: python projector.py rebuild")
+        return 2
+    if db is None:
+        print("MONGODB_URI is not configured")
+        return 1
+    print(f"{VIEW_COLLECTION}: projected {await OrderProjector(db).rebuild()} orders")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main(sys.argv)))
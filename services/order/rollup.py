@@ -0,0 +1,286 @@
+"""
+Rollup số order theo status theo giờ / ngày (collection OrderStats): cập nhật dần từ event trên
+order.events, lịch sử được dựng lại từ collection Order bằng aggregation (backfill)
+
+Backfill tay (xoá và dựng lại OrderStats, OrderRollupState):
+    python rollup.py backfill
+"""
+
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from aiokafka import AIOKafkaConsumer
+from aiokafka.errors import KafkaError
+from aiokafka.structs import TopicPartition
+from prometheus_client import Counter
+from pymongo import ASCENDING, IndexModel, UpdateOne
+from pymongo.errors import PyMongoError
+
+from deadline import with_deadline
+
+logger = logging.getLogger(__name__)
+
+STATS_COLLECTION = "OrderStats"
+# Status và bucket hiện tại của từng order, để biết bucket nào cần trừ khi status đổi
+STATE_COLLECTION = "OrderRollupState"
+
+ORDER_ROLLUP_GROUP = os.getenv("ORDER_ROLLUP_GROUP", "order-rollup")
+# Số bucket tối đa một lần gọi /orders/stats (mặc định: 31 ngày theo giờ)
+ORDER_STATS_MAX_BUCKETS = int(os.getenv("ORDER_STATS_MAX_BUCKETS", "744"))
+# Event áp dụng lỗi (Mongo) được thử lại; thời gian chờ (giây) tăng gấp đôi mỗi lần, tới giá trị tối đa
+ORDER_ROLLUP_RETRY_SECONDS = float(os.getenv("ORDER_ROLLUP_RETRY_SECONDS", "1"))
+ORDER_ROLLUP_RETRY_MAX_SECONDS = float(os.getenv("ORDER_ROLLUP_RETRY_MAX_SECONDS", "30"))
+
+GRANULARITIES = {"hour": timedelta(hours=1), "day": timedelta(days=1)}
+
+# Mỗi document là một (granularity, bucket, status): query stats là range scan trên index này
+STATS_INDEXES = [
+    IndexModel([("g", ASCENDING), ("start", ASCENDING), ("status", ASCENDING)]),
+]
+
+order_rollup_events_total = Counter(
+    'order_rollup_events_total', 'Order events consumed by the stats rollup', ['result']
+)
+order_rollup_retries_total = Counter(
+    'order_rollup_retries_total', 'Order event applications retried after a MongoDB error'
+)
+
+
+def to_utc(value: Any) -> Optional[datetime]:
+    """Naive UTC datetime (as stored by PyMongo) from a datetime, ISO string or epoch seconds"""
+    if isinstance(value, datetime):
+        return value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo else value
+    if isinstance(value, str):
+        try:
+            return to_utc(datetime.fromisoformat(value.replace("Z", "+00:00")))
+        except ValueError:
+            return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return datetime.fromtimestamp(value, timezone.utc).replace(tzinfo=None)
+    return None
+
+
+def bucket_start(ts: datetime, granularity: str) -> datetime:
+    if granularity == "day":
+        return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+def _bucket_id(granularity: str, start: datetime, status: str) -> str:
+    # Cùng định dạng với $dateToString trong backfill
+    return f"{granularity}|{start.strftime('%Y-%m-%dT%H:%M:%S')}|{status}"
+
+
+def _inc_ops(created: datetime, status: str, delta: int) -> List[UpdateOne]:
+    ops = []
+    for granularity in GRANULARITIES:
+        start = bucket_start(created, granularity)
+        ops.append(UpdateOne(
+            {"_id": _bucket_id(granularity, start, status)},
+            {"$inc": {"count": delta}, "$setOnInsert": {"g": granularity, "start": start, "status": status}},
+            upsert=True,
+        ))
+    return ops
+
+
+class OrderRollup:
+    """
+    Orders per status per hour and per day, bucketed by the order's createdAt.
+
+    Each event carrying `orderId` and `status` moves the order from its
+    previous status bucket to the new one (two $inc per granularity), so a
+    stats query reads one document per (bucket, status) instead of scanning
+    orders. Events that repeat the current status are no-ops; events are
+    keyed by orderId, so a partition delivers one order's events in order.
+    The state and bucket writes of one event commit in a single transaction
+    (transactions need a replica set, as change streams already do). The
+    Kafka offset is committed only once the event is applied; a failed
+    event is retried with backoff, holding back its partition meanwhile.
+    """
+
+    def __init__(self, db):
+        self.client = db.client
+        self.orders = db.Order
+        self.stats_collection = db[STATS_COLLECTION]
+        self.state = db[STATE_COLLECTION]
+        self._consumer: Optional[AIOKafkaConsumer] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def apply(self, event: Dict[str, Any]) -> str:
+        """Fold one order event into the rollup; returns the outcome label"""
+        order_id, status = event.get("orderId"), event.get("status")
+        if not order_id or not isinstance(status, str):
+            return "ignored"
+        order_id = str(order_id)
+
+        # State và bucket đổi cùng một transaction: lỗi (hoặc process chết) giữa chừng không để lại
+        # state mới với count cũ, nên event được gửi lại vẫn được áp dụng đúng một lần
+        async def transition(session) -> str:
+            return await self._apply(order_id, status, event, session)
+
+        async with await self.client.start_session() as session:
+            return await session.with_transaction(transition)
+
+    async def _apply(self, order_id: str, status: str, event: Dict[str, Any], session) -> str:
+        previous = await self.state.find_one({"_id": order_id}, session=session)
+        if previous is not None and previous.get("status") == status:
+            return "duplicate"
+
+        created = previous.get("createdAt") if previous is not None else None
+        created = created or to_utc(event.get("createdAt"))
+        if created is None:
+            order = await self.orders.find_one({"orderId": order_id}, {"createdAt": 1}, session=session)
+            created = to_utc(order.get("createdAt")) if order else None
+        created = created or datetime.now(timezone.utc).replace(tzinfo=None)
+
+        ops = _inc_ops(created, status, 1)
+        if previous is not None and isinstance(previous.get("status"), str):
+            ops += _inc_ops(created, previous["status"], -1)
+        await self.stats_collection.bulk_write(ops, ordered=False, session=session)
+        await self.state.update_one(
+            {"_id": order_id}, {"$set": {"status": status, "createdAt": created}}, upsert=True, session=session
+        )
+        return "applied"
+
+    async def stats(
+        self,
+        granularity: str,
+        start: datetime,
+        end: datetime,
+        statuses: Optional[List[str]] = None,
+    ) -> List[Dict[str, Any]]:
+        """Buckets in [start, end) with their non-zero counts per status"""
+        query: Dict[str, Any] = {"g": granularity, "start": {"$gte": start, "$lt": end}}
+        if statuses:
+            query["status"] = {"$in": statuses}
+        docs = await with_deadline(self.stats_collection.find(
+            query, {"_id": 0, "start": 1, "status": 1, "count": 1}
+        ).sort([("start", ASCENDING), ("status", ASCENDING)])).to_list(length=None)
+        buckets: Dict[datetime, Dict[str, int]] = {}
+        for doc in docs:
+            if doc["count"]:
+                buckets.setdefault(doc["start"], {})[doc["status"]] = doc["count"]
+        return [{"start": start, "counts": counts} for start, counts in buckets.items()]
+
+    async def backfill(self) -> None:
+        """Rebuild the per-order state and every bucket from the Order collection"""
+        await self.state.delete_many({})
+        await self.orders.aggregate([
+            {"$match": {"orderId": {"$exists": True}, "status": {"$type": "string"}}},
+            {"$project": {
+                "_id": {"$toString": "$orderId"},
+                "status": 1,
+                # createdAt lưu dạng chuỗi được chuyển sang date; thiếu thì lấy thời điểm tạo từ ObjectId
+                "createdAt": {"$convert": {
+                    "input": "$createdAt",
+                    "to": "date",
+                    "onError": {"$toDate": "$_id"},
+                    "onNull": {"$toDate": "$_id"},
+                }},
+            }},
+            {"$merge": {"into": STATE_COLLECTION, "whenMatched": "replace"}},
+        ]).to_list(length=None)
+
+        await self.stats_collection.delete_many({})
+        for granularity in GRANULARITIES:
+            await self.state.aggregate([
+                {"$group": {
+                    "_id": {"start": {"$dateTrunc": {"date": "$createdAt", "unit": granularity}}, "status": "$status"},
+                    "count": {"$sum": 1},
+                }},
+                {"$project": {
+                    "_id": {"$concat": [
+                        granularity, "|",
+                        {"$dateToString": {"date": "$_id.start", "format": "%Y-%m-%dT%H:%M:%S"}}, "|",
+                        "$_id.status",
+                    ]},
+                    "g": {"$literal": granularity},
+                    "start": "$_id.start",
+                    "status": "$_id.status",
+                    "count": 1,
+                }},
+                {"$merge": {"into": STATS_COLLECTION, "whenMatched": "replace"}},
+            ]).to_list(length=None)
+
+    async def _handle(self, message) -> str:
+        try:
+            event = json.loads(message.value)
+        except ValueError:
+            return "invalid"
+        if not isinstance(event, dict):
+            return "invalid"
+        delay = ORDER_ROLLUP_RETRY_SECONDS
+        while True:
+            try:
+                return await self.apply(event)
+            except PyMongoError as e:
+                # Transaction đã bị huỷ nên thử lại an toàn; bỏ qua event thì bucket lệch vĩnh viễn
+                order_rollup_retries_total.inc()
+                logger.warning(f"Order rollup failed for event {event.get('orderId')}, retrying in {delay:g}s: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, ORDER_ROLLUP_RETRY_MAX_SECONDS)
+
+    async def _consume(self) -> None:
+        async for message in self._consumer:
+            result = await self._handle(message)
+            order_rollup_events_total.labels(result=result).inc()
+            # Commit offset sau khi event đã áp dụng: dừng/crash trước đó thì event được giao lại
+            try:
+                await self._consumer.commit({TopicPartition(message.topic, message.partition): message.offset + 1})
+            except KafkaError as e:
+                # VD: rebalance; event được giao lại cho consumer khác và áp dụng lại là no-op
+                logger.warning(f"Order rollup offset commit failed: {e}")
+
+    async def start(self, bootstrap_servers: str, topic: str) -> None:
+        """Consume `topic` in the ORDER_ROLLUP_GROUP group (partitions shared across replicas)"""
+        if self._task is not None:
+            return
+        consumer = AIOKafkaConsumer(
+            topic,
+            bootstrap_servers=bootstrap_servers,
+            group_id=ORDER_ROLLUP_GROUP,
+            enable_auto_commit=False,
+            auto_offset_reset="latest",
+        )
+        try:
+            await consumer.start()
+        except Exception as e:
+            logger.warning(f"Order rollup consumer not started: {e}")
+            return
+        self._consumer = consumer
+        self._task = asyncio.create_task(self._consume())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError, Exception):
+                await self._task
+            self._task = None
+        if self._consumer:
+            with contextlib.suppress(Exception):
+                await self._consumer.stop()
+            self._consumer = None
+
+
+async def _main(argv: List[str]) -> int:
+    from db import db
+
+    if argv[1:] != ["backfill"]:
+        print("usage: python rollup.py backfill")
+        return 2
+    if db is None:
+        print("MONGODB_URI is not configured")
+        return 1
+    await OrderRollup(db).backfill()
+    print(f"{STATS_COLLECTION}: {await db[STATS_COLLECTION].estimated_document_count()} buckets")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main(sys.argv)))
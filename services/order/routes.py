@@ -1,25 +1,232 @@
-from fastapi import APIRouter, HTTPException, Body
-from db import db
+import asyncio
+from datetime import datetime, timezone
+from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Request, Body, Query
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from db import db, hedge_reader
+from changes import CollectionVersion, CollectionWatcher
+from counting import CountCache
+from deadline import remaining_ms
+from indexes import ensure_indexes
+from listing import DEFAULT_PAGE_SIZE, batch_get, count_documents, list_documents
+from loader import BatchLoader, parse_id
+from projector import EMBEDDED, ORDER_VIEW_INDEXES, VIEW_COLLECTION, OrderProjector
+from rollup import GRANULARITIES, ORDER_STATS_MAX_BUCKETS, STATS_COLLECTION, STATS_INDEXES, OrderRollup, bucket_start, to_utc
+from serialization import BSONJSONResponse
 
 router = APIRouter()
 
+# Các field client được phép chọn qua ?fields= (projection đẩy xuống Mongo)
+ORDER_FIELDS = {
+    "orderId",
+    "customerId",
+    "driverId",
+    "vehicleId",
+    "status",
+    "pickupAddress",
+    "deliveryAddress",
+    "totalAmount",
+    "createdAt",
+    "updatedAt",
+}
+
+# Field được phép filter (?field=value hoặc ?field=a,b) và hàm chuyển kiểu giá trị
+ORDER_FILTERS = {
+    "orderId": str,
+    "customerId": str,
+    "driverId": str,
+    "vehicleId": str,
+    "status": str,
+}
+
+# Index khai báo cho collection: được tạo lúc startup (indexes.ensure_indexes) và query planner
+# dựa vào đây để từ chối query quét toàn bộ collection. TTL: IndexModel(..., expireAfterSeconds=N)
+ORDER_INDEXES = [
+    IndexModel([("orderId", ASCENDING)], unique=True),
+    IndexModel([("status", ASCENDING), ("createdAt", DESCENDING), ("_id", DESCENDING)]),
+    IndexModel([("customerId", ASCENDING), ("createdAt", DESCENDING), ("_id", DESCENDING)]),
+    IndexModel([("driverId", ASCENDING), ("createdAt", DESCENDING), ("_id", DESCENDING)]),
+    IndexModel([("createdAt", DESCENDING), ("_id", DESCENDING)]),
+    IndexModel([("updatedAt", DESCENDING)]),
+]
+
+# (collection, index spec) của service, dùng cho startup và `python indexes.py`
+INDEX_SPECS = [
+    ("Order", ORDER_INDEXES),
+    (STATS_COLLECTION, STATS_INDEXES),
+    (VIEW_COLLECTION, ORDER_VIEW_INDEXES),
+]
+
+# Deadline (ms) riêng cho từng route (theo path template); route khác dùng REQUEST_DEADLINE_MS
+ROUTE_DEADLINES_MS = {
+    "/orders/{order_id}": 2000,
+    "/orders:batchGet": 3000,
+    "/orders/count": 3000,
+    "/orders/stats": 3000,
+    "/orders/view/{order_id}": 2000,
+}
+
+# Change stream của collection: cập nhật version token cho ETag và làm mới count
+order_watcher = CollectionWatcher("order")
+order_version = CollectionVersion(order_watcher)
+order_counts = CountCache("order", order_watcher)
+
+# Collection dùng cho hedged read (None nếu MONGODB_HEDGED_READS tắt)
+order_hedge = hedge_reader("Order")
+
+# Gộp các lookup theo id đồng thời thành một query $in
+order_loader = BatchLoader("order", db.Order, hedge_collection=order_hedge) if db is not None else None
+
+# Số order theo status theo giờ/ngày, cập nhật từ order.events (xem rollup.py)
+order_rollup = OrderRollup(db) if db is not None else None
+
+# Read model OrderView (order kèm customer/driver/vehicle), xem projector.py
+order_projector = OrderProjector(db) if db is not None else None
+ORDER_VIEW_FIELDS = ORDER_FIELDS | set(EMBEDDED)
+
+_index_task: Optional[asyncio.Future] = None
+
+
+@router.on_event("startup")
+async def _start_change_watcher():
+    if db is not None:
+        order_watcher.start(db.Order)
+        order_counts.start(db.Order)
+
+
+@router.on_event("startup")
+async def _ensure_indexes():
+    global _index_task
+    if db is not None:
+        # Chạy nền để việc build index trên collection lớn không chặn readiness
+        _index_task = asyncio.gather(*(ensure_indexes(db[name], spec) for name, spec in INDEX_SPECS))
+
+
+@router.on_event("shutdown")
+async def _stop_change_watcher():
+    await order_watcher.stop()
+    await order_counts.stop()
+
 
 @router.get("/orders")
-async def get_orders():
+async def get_orders(
+    request: Request,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1),
+    after: Optional[str] = Query(None, description="Cursor `next` của trang trước"),
+    stream: bool = Query(False, description="Trả về NDJSON stream toàn bộ collection"),
+    fields: Optional[str] = Query(None, description="Danh sách field, phân cách bằng dấu phẩy"),
+    sort: Optional[str] = Query(None, description="VD: -createdAt (dấu - là giảm dần)"),
+):
+    if db is None:
+        raise HTTPException(status_code=500, detail="MONGODB_URI is not configured")
+    return await list_documents(
+        request,
+        db.Order,
+        limit=limit,
+        after=after,
+        stream=stream,
+        fields=fields,
+        sort=sort,
+        allowed_fields=ORDER_FIELDS,
+        filters=ORDER_FILTERS,
+        indexes=ORDER_INDEXES,
+        version=order_version,
+        hedge=order_hedge,
+    )
+
+
+@router.get("/orders/count")
+async def count_order(request: Request):
+    if db is None:
+        raise HTTPException(status_code=500, detail="MONGODB_URI is not configured")
+    return await count_documents(request, db.Order, order_counts, ORDER_FILTERS, ORDER_INDEXES)
+
+
+@router.post("/orders:batchGet")
+async def batch_get_order(ids: List[str] = Body(..., embed=True)):
     if db is None:
         raise HTTPException(status_code=500, detail="MONGODB_URI is not configured")
-    docs = await db.Order.find().to_list(length=None)
-    for d in docs:
-        if "_id" in d:
-            d["_id"] = str(d["_id"])  # serialize ObjectId
-    return docs
+    return await batch_get(order_loader, ids)
+
+
+@router.get("/orders/stats")
+async def order_stats(
+    granularity: str = Query("hour", pattern="^(hour|day)$"),
+    start: Optional[datetime] = Query(None, alias="from", description="Mặc định: 24 bucket trước `to`"),
+    end: Optional[datetime] = Query(None, alias="to", description="Mặc định: hiện tại"),
+    status: Optional[str] = Query(None, description="Danh sách status, phân cách bằng dấu phẩy"),
+):
+    if order_rollup is None:
+        raise HTTPException(status_code=500, detail="MONGODB_URI is not configured")
+    step = GRANULARITIES[granularity]
+    end = to_utc(end) if end else datetime.now(timezone.utc).replace(tzinfo=None)
+    # `to` không tính vào kết quả; làm tròn lên biên bucket để bucket hiện tại vẫn có mặt
+    boundary = bucket_start(end, granularity)
+    end = boundary if boundary == end else boundary + step
+    start = bucket_start(to_utc(start), granularity) if start else end - 24 * step
+    if start >= end:
+        raise HTTPException(status_code=400, detail="`from` must be before `to`")
+    if (end - start) / step > ORDER_STATS_MAX_BUCKETS:
+        raise HTTPException(
+            status_code=400, detail=f"Range covers more than {ORDER_STATS_MAX_BUCKETS} {granularity} buckets"
+        )
+    statuses = [s for s in status.split(",") if s] if status else None
+    buckets = await order_rollup.stats(granularity, start, end, statuses)
+    return BSONJSONResponse(content={"granularity": granularity, "from": start, "to": end, "buckets": buckets})
+
+
+@router.get("/orders/view")
+async def get_order_views(
+    request: Request,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1),
+    after: Optional[str] = Query(None, description="Cursor `next` của trang trước"),
+    stream: bool = Query(False, description="Trả về NDJSON stream toàn bộ collection"),
+    fields: Optional[str] = Query(None, description="Danh sách field, phân cách bằng dấu phẩy"),
+    sort: Optional[str] = Query(None, description="VD: -createdAt (dấu - là giảm dần)"),
+):
+    if db is None:
+        raise HTTPException(status_code=500, detail="MONGODB_URI is not configured")
+    return await list_documents(
+        request,
+        db[VIEW_COLLECTION],
+        limit=limit,
+        after=after,
+        stream=stream,
+        fields=fields,
+        sort=sort,
+        allowed_fields=ORDER_VIEW_FIELDS,
+        filters=ORDER_FILTERS,
+        indexes=ORDER_VIEW_INDEXES,
+    )
+
+
+@router.get("/orders/view/{order_id}")
+async def get_order_view(order_id: str):
+    if db is None:
+        raise HTTPException(status_code=500, detail="MONGODB_URI is not configured")
+    doc = await db[VIEW_COLLECTION].find_one({"_id": order_id}, max_time_ms=remaining_ms())
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    return BSONJSONResponse(content=doc)
+
+
+# Route /orders/{id} để cuối cùng: các route GET /orders/<tên> cố định phải khai báo phía trên
+@router.get("/orders/{order_id}")
+async def get_order_by_id(order_id: str):
+    if db is None:
+        raise HTTPException(status_code=500, detail="MONGODB_URI is not configured")
+    doc = await order_loader.load(parse_id(order_id))
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    return BSONJSONResponse(content=doc)
     
 
 # uvicorn main:app --reload --host 0.0.0.0 --port 8000
 
 # Prometheus metrics
 from fastapi.responses import Response
-from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import Counter, Histogram
+from exposition import CONTENT_TYPE_LATEST, metrics_exposition
 import os
 import json
 from aiokafka import AIOKafkaProducer
@@ -37,7 +244,7 @@ producer: Optional[AIOKafkaProducer] = None
 @router.get("/metrics")
 async def metrics():
     """Prometheus metrics endpoint"""
-    data = generate_latest()
+    data = await metrics_exposition()
     return Response(content=data, media_type=CONTENT_TYPE_LATEST)
 
 
@@ -57,6 +264,30 @@ async def _stop_kafka_producer():
         await producer.stop()
 
 
+@router.on_event("startup")
+async def _start_order_rollup():
+    if order_rollup is not None:
+        await order_rollup.start(KAFKA_BOOTSTRAP, KAFKA_TOPIC)
+
+
+@router.on_event("shutdown")
+async def _stop_order_rollup():
+    if order_rollup is not None:
+        await order_rollup.stop()
+
+
+@router.on_event("startup")
+async def _start_order_projector():
+    if order_projector is not None:
+        await order_projector.start(KAFKA_BOOTSTRAP, KAFKA_TOPIC)
+
+
+@router.on_event("shutdown")
+async def _stop_order_projector():
+    if order_projector is not None:
+        await order_projector.stop()
+
+
 @router.post("/orders/event")
 async def publish_order_event(payload: dict = Body(...)):
     if producer is None:
@@ -0,0 +1,70 @@
+"""
+Cấu hình gunicorn: chạy nhiều worker uvicorn trong một container, số worker theo giới hạn CPU
+của container. Metrics Prometheus của các worker được ghi vào thư mục chung (PROMETHEUS_MULTIPROC_DIR)
+và gộp lại ở /metrics (xem exposition.py)
+
+Usage: gunicorn main:app -c gunicorn.conf.py
+"""
+
+import math
+import os
+import shutil
+
+# Đặt trước khi worker import prometheus_client; trên k8s nên trỏ vào một emptyDir của pod
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus-multiproc")
+# Các worker dùng chung một cache response (sharedcache.py) thay vì mỗi worker một bản
+os.environ.setdefault("RESPONSE_CACHE_SHARED", "true")
+
+PROMETHEUS_MULTIPROC_DIR = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+
+
+def _read(path: str) -> str:
+    with open(path) as f:
+        return f.read().strip()
+
+
+def cpu_limit() -> int:
+    """CPUs this container may use: the cgroup quota rounded up, else the CPUs the process can run on"""
+    try:
+        # cgroup v2: "<quota> <period>" hoặc "max <period>"
+        quota, period = _read("/sys/fs/cgroup/cpu.max").split()
+        if quota != "max":
+            return max(1, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    try:
+        # cgroup v1: quota = -1 khi không giới hạn
+        quota = int(_read("/sys/fs/cgroup/cpu/cpu.cfs_quota_us"))
+        period = int(_read("/sys/fs/cgroup/cpu/cpu.cfs_period_us"))
+        if quota > 0 and period > 0:
+            return max(1, math.ceil(quota / period))
+    except (OSError, ValueError):
+        pass
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+worker_class = "uvicorn.workers.UvicornWorker"
+# WEB_CONCURRENCY ghi đè số worker tính từ giới hạn CPU
+workers = int(os.getenv("WEB_CONCURRENCY") or cpu_limit())
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+accesslog = None
+
+
+def on_starting(server):
+    # File .db của lần chạy trước (container restart, emptyDir còn giữ) sẽ bị cộng dồn vào metrics mới
+    shutil.rmtree(PROMETHEUS_MULTIPROC_DIR, ignore_errors=True)
+    os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+    server.log.info(f"Starting {workers} worker(s), Prometheus multiprocess dir {PROMETHEUS_MULTIPROC_DIR}")
+
+
+def child_exit(server, worker):
+    # Gauge livesum/liveall của worker đã chết không còn được tính; counter/histogram vẫn giữ
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid, PROMETHEUS_MULTIPROC_DIR)
@@ -0,0 +1,101 @@
+"""
+Gộp các lookup theo _id đến cùng lúc thành một query {_id: {$in: [...]}} (kiểu DataLoader)
+"""
+
+import asyncio
+import os
+from typing import Any, Dict, Hashable, Iterable, List, Optional
+
+from bson import ObjectId
+from prometheus_client import Counter, Histogram
+
+from hedging import hedged_read
+
+# Cửa sổ gom request (giây) và số key tối đa mỗi query
+LOADER_WINDOW_SECONDS = float(os.getenv("LOADER_WINDOW_SECONDS", "0.002"))
+LOADER_MAX_BATCH = int(os.getenv("LOADER_MAX_BATCH", "100"))
+
+batch_loader_keys_total = Counter(
+    'batch_loader_keys_total', 'Keys requested through the batch loader', ['loader']
+)
+batch_loader_queries_total = Counter(
+    'batch_loader_queries_total', 'Mongo queries issued by the batch loader', ['loader']
+)
+batch_loader_batch_size = Histogram(
+    'batch_loader_batch_size', 'Distinct keys per batch loader query', ['loader'],
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500)
+)
+
+
+def parse_id(value: str) -> Any:
+    """ObjectId for 24-char hex ids, the raw string otherwise"""
+    return ObjectId(value) if ObjectId.is_valid(value) else value
+
+
+class BatchLoader:
+    """
+    Coalesce concurrent `_id` lookups on one collection.
+
+    The first `load` in a window schedules a flush after `window` seconds;
+    every key requested until then (or until `max_batch` keys) is fetched
+    with a single `$in` query and each caller gets its own document.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        collection,
+        window: float = LOADER_WINDOW_SECONDS,
+        max_batch: int = LOADER_MAX_BATCH,
+        hedge_collection=None,
+    ):
+        self.name = name
+        self.collection = collection
+        self.hedge_collection = hedge_collection
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: Dict[Hashable, List[asyncio.Future]] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    async def load(self, key: Any) -> Optional[Dict[str, Any]]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.setdefault(key, []).append(future)
+        batch_loader_keys_total.labels(loader=self.name).inc()
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    async def load_many(self, keys: Iterable[Any]) -> List[Optional[Dict[str, Any]]]:
+        return list(await asyncio.gather(*(self.load(k) for k in keys)))
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, {}
+        if batch:
+            asyncio.ensure_future(self._dispatch(batch))
+
+    async def _dispatch(self, batch: Dict[Hashable, List[asyncio.Future]]) -> None:
+        batch_loader_queries_total.labels(loader=self.name).inc()
+        batch_loader_batch_size.labels(loader=self.name).observe(len(batch))
+        try:
+            docs = await hedged_read(
+                lambda c: c.find({"_id": {"$in": list(batch)}}).to_list(length=len(batch)),
+                self.collection,
+                self.hedge_collection,
+            )
+        except Exception as e:
+            for futures in batch.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+        found = {d["_id"]: d for d in docs}
+        for key, futures in batch.items():
+            for future in futures:
+                if not future.done():
+                    future.set_result(found.get(key))
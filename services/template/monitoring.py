@@ -0,0 +1,236 @@
+"""
+PyMongo event listener xuất metrics Prometheus cho connection pool và thời gian thực thi command
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Set, Tuple
+
+from prometheus_client import Counter, Gauge, Histogram
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# Command chậm hơn ngưỡng này (ms) sẽ được log kèm shape của filter
+MONGODB_SLOW_COMMAND_MS = float(os.getenv("MONGODB_SLOW_COMMAND_MS", "100"))
+
+mongodb_pool_connections = Gauge(
+    'mongodb_pool_connections', 'Open connections in the pool', ['address'],
+    multiprocess_mode='livesum',
+)
+mongodb_pool_checked_out_connections = Gauge(
+    'mongodb_pool_checked_out_connections', 'Connections currently checked out of the pool', ['address'],
+    multiprocess_mode='livesum',
+)
+mongodb_pool_connections_created_total = Counter(
+    'mongodb_pool_connections_created_total', 'Connections created by the pool', ['address']
+)
+mongodb_pool_connections_closed_total = Counter(
+    'mongodb_pool_connections_closed_total', 'Connections closed by the pool', ['address', 'reason']
+)
+mongodb_pool_checkout_failures_total = Counter(
+    'mongodb_pool_checkout_failures_total', 'Failed connection check outs', ['address', 'reason']
+)
+mongodb_pool_wait_seconds = Histogram(
+    'mongodb_pool_wait_seconds', 'Time spent waiting to check out a connection', ['address'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+mongodb_command_duration_seconds = Histogram(
+    'mongodb_command_duration_seconds', 'MongoDB command duration', ['collection', 'command', 'outcome'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+
+
+class LatencyTracker:
+    """
+    Rolling window of recent command durations per (collection, command).
+
+    Fed by CommandMetricsListener alongside mongodb_command_duration_seconds;
+    gives the current p95 that hedged reads use as their delay.
+    """
+
+    def __init__(self, window: int = 512, min_samples: int = 20):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples: Dict[Tuple[str, str], Deque[float]] = {}
+
+    def observe(self, collection: str, command: str, seconds: float) -> None:
+        samples = self._samples.get((collection, command))
+        if samples is None:
+            samples = self._samples[(collection, command)] = deque(maxlen=self.window)
+        samples.append(seconds)
+
+    def quantile(self, collection: str, command: str, q: float = 0.95) -> Optional[float]:
+        """None until enough samples have been seen"""
+        samples = self._samples.get((collection, command))
+        if not samples or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+# Dùng chung trong process: listener ghi, hedging.py đọc
+command_latency = LatencyTracker()
+
+
+def _address(address) -> str:
+    host, port = address
+    return f"{host}:{port}"
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """
+    Export pool usage on /metrics.
+
+    Check-out start and end are reported on the same (executor) thread, so a
+    thread-local timestamp is enough to measure wait-queue time.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        address = _address(event.address)
+        mongodb_pool_connections_created_total.labels(address=address).inc()
+        mongodb_pool_connections.labels(address=address).inc()
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        address = _address(event.address)
+        mongodb_pool_connections_closed_total.labels(address=address, reason=event.reason).inc()
+        mongodb_pool_connections.labels(address=address).dec()
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def _observe_wait(self, address: str) -> None:
+        started = getattr(self._local, "started", None)
+        if started is not None:
+            mongodb_pool_wait_seconds.labels(address=address).observe(time.perf_counter() - started)
+            self._local.started = None
+
+    def connection_check_out_failed(self, event):
+        address = _address(event.address)
+        self._observe_wait(address)
+        mongodb_pool_checkout_failures_total.labels(address=address, reason=event.reason).inc()
+
+    def connection_checked_out(self, event):
+        address = _address(event.address)
+        self._observe_wait(address)
+        mongodb_pool_checked_out_connections.labels(address=address).inc()
+
+    def connection_checked_in(self, event):
+        mongodb_pool_checked_out_connections.labels(address=_address(event.address)).dec()
+
+
+def redact(value: Any) -> Any:
+    """Keep the keys and operators of a filter, replace every value with '?'"""
+    if isinstance(value, dict):
+        return {k: redact(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        if value and all(isinstance(v, dict) for v in value):
+            return [redact(v) for v in value]
+        return "?"
+    return "?"
+
+
+def _command_target(command_name: str, command: Dict[str, Any]) -> Tuple[str, Any]:
+    """(collection, filter shape) of a command as sent to the server"""
+    if command_name == "getMore":
+        return str(command.get("collection", "")), None
+    target = command.get(command_name)
+    collection = target if isinstance(target, str) else ""
+    if command_name in ("find", "count", "countDocuments"):
+        shape = command.get("filter", command.get("query"))
+    elif command_name == "aggregate":
+        shape = command.get("pipeline")
+    elif command_name in ("update", "delete"):
+        statements = command.get("updates" if command_name == "update" else "deletes") or [{}]
+        shape = statements[0].get("q")
+    elif command_name == "findAndModify":
+        shape = command.get("query")
+    else:
+        shape = None
+    return collection, redact(shape) if shape is not None else None
+
+
+class CommandMetricsListener(monitoring.CommandListener):
+    """
+    Record every command in mongodb_command_duration_seconds and log slow ones.
+
+    Started events are matched to their outcome by (connection, request id);
+    only the collection name and the redacted filter shape are kept.
+    Change stream cursors are tracked by id: their getMores wait on the
+    server (awaitData) while the collection is idle, so they are neither
+    timed nor reported as slow.
+    """
+
+    def __init__(self, slow_ms: float = MONGODB_SLOW_COMMAND_MS):
+        self.slow_ms = slow_ms
+        self._inflight: Dict[Tuple[Any, int], Tuple[str, Any, Optional[int]]] = {}
+        self._change_streams: Set[int] = set()
+
+    def _change_stream_cursor(self, command_name: str, command: Dict[str, Any]) -> Optional[int]:
+        """Cursor id for a change stream getMore, 0 for the aggregate opening one, None otherwise"""
+        if command_name == "aggregate":
+            pipeline = command.get("pipeline") or []
+            if pipeline and isinstance(pipeline[0], dict) and "$changeStream" in pipeline[0]:
+                return 0
+        elif command_name == "getMore":
+            cursor_id = command.get("getMore")
+            if cursor_id in self._change_streams:
+                return cursor_id
+        elif command_name == "killCursors":
+            self._change_streams.difference_update(command.get("cursors") or [])
+        return None
+
+    def started(self, event):
+        collection, shape = _command_target(event.command_name, event.command)
+        cursor = self._change_stream_cursor(event.command_name, event.command)
+        self._inflight[(event.connection_id, event.request_id)] = (collection, shape, cursor)
+
+    def _finish(self, event, outcome: str) -> None:
+        collection, shape, cursor = self._inflight.pop((event.connection_id, event.request_id), ("", None, None))
+        if cursor is not None:
+            reply_cursor = ((getattr(event, "reply", None) or {}).get("cursor") or {}).get("id", 0)
+            if event.command_name == "getMore":
+                if outcome != "success" or not reply_cursor:
+                    # Cursor đã đóng hoặc lỗi: server không giữ nó nữa
+                    self._change_streams.discard(cursor)
+                return
+            if outcome == "success" and reply_cursor:
+                self._change_streams.add(reply_cursor)
+        seconds = event.duration_micros / 1e6
+        mongodb_command_duration_seconds.labels(
+            collection=collection, command=event.command_name, outcome=outcome
+        ).observe(seconds)
+        if outcome == "success":
+            command_latency.observe(collection, event.command_name, seconds)
+        if seconds * 1000 >= self.slow_ms:
+            logger.warning(
+                f"Slow MongoDB command {event.command_name} on {collection or '-'}: "
+                f"{seconds * 1000:.1f} ms, outcome={outcome}, filter={shape}"
+            )
+
+    def succeeded(self, event):
+        self._finish(event, "success")
+
+    def failed(self, event):
+        self._finish(event, "failure")
@@ -1,25 +1,154 @@
-from fastapi import APIRouter, HTTPException
-from db import db
+import asyncio
+from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Request, Body, Query
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from db import db, hedge_reader
+from changes import CollectionVersion, CollectionWatcher
+from counting import CountCache
+from indexes import ensure_indexes
+from listing import DEFAULT_PAGE_SIZE, batch_get, count_documents, list_documents
+from loader import BatchLoader, parse_id
+from serialization import BSONJSONResponse
 
 router = APIRouter()
 
+# Các field client được phép chọn qua ?fields= (projection đẩy xuống Mongo)
+ORDER_FIELDS = {
+    "orderId",
+    "customerId",
+    "driverId",
+    "vehicleId",
+    "status",
+    "pickupAddress",
+    "deliveryAddress",
+    "totalAmount",
+    "createdAt",
+    "updatedAt",
+}
+
+# Field được phép filter (?field=value hoặc ?field=a,b) và hàm chuyển kiểu giá trị
+ORDER_FILTERS = {
+    "orderId": str,
+    "customerId": str,
+    "driverId": str,
+    "vehicleId": str,
+    "status": str,
+}
+
+# Index khai báo cho collection: được tạo lúc startup (indexes.ensure_indexes) và query planner
+# dựa vào đây để từ chối query quét toàn bộ collection. TTL: IndexModel(..., expireAfterSeconds=N)
+ORDER_INDEXES = [
+    IndexModel([("orderId", ASCENDING)], unique=True),
+    IndexModel([("status", ASCENDING), ("createdAt", DESCENDING), ("_id", DESCENDING)]),
+    IndexModel([("customerId", ASCENDING), ("createdAt", DESCENDING), ("_id", DESCENDING)]),
+    IndexModel([("driverId", ASCENDING), ("createdAt", DESCENDING), ("_id", DESCENDING)]),
+    IndexModel([("createdAt", DESCENDING), ("_id", DESCENDING)]),
+    IndexModel([("updatedAt", DESCENDING)]),
+]
+
+# (collection, index spec) của service, dùng cho startup và `python indexes.py`
+INDEX_SPECS = [("Order", ORDER_INDEXES)]
+
+# Deadline (ms) riêng cho từng route (theo path template); route khác dùng REQUEST_DEADLINE_MS
+ROUTE_DEADLINES_MS = {
+    "/orders/{order_id}": 2000,
+    "/orders:batchGet": 3000,
+    "/orders/count": 3000,
+}
+
+# Change stream của collection: cập nhật version token cho ETag và làm mới count
+order_watcher = CollectionWatcher("order")
+order_version = CollectionVersion(order_watcher)
+order_counts = CountCache("order", order_watcher)
+
+# Collection dùng cho hedged read (None nếu MONGODB_HEDGED_READS tắt)
+order_hedge = hedge_reader("Order")
+
+# Gộp các lookup theo id đồng thời thành một query $in
+order_loader = BatchLoader("order", db.Order, hedge_collection=order_hedge) if db is not None else None
+
+_index_task: Optional[asyncio.Future] = None
+
+
+@router.on_event("startup")
+async def _start_change_watcher():
+    if db is not None:
+        order_watcher.start(db.Order)
+        order_counts.start(db.Order)
+
+
+@router.on_event("startup")
+async def _ensure_indexes():
+    global _index_task
+    if db is not None:
+        # Chạy nền để việc build index trên collection lớn không chặn readiness
+        _index_task = asyncio.gather(*(ensure_indexes(db[name], spec) for name, spec in INDEX_SPECS))
+
+
+@router.on_event("shutdown")
+async def _stop_change_watcher():
+    await order_watcher.stop()
+    await order_counts.stop()
+
 
 @router.get("/orders")
-async def get_orders():
+async def get_orders(
+    request: Request,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1),
+    after: Optional[str] = Query(None, description="Cursor `next` của trang trước"),
+    stream: bool = Query(False, description="Trả về NDJSON stream toàn bộ collection"),
+    fields: Optional[str] = Query(None, description="Danh sách field, phân cách bằng dấu phẩy"),
+    sort: Optional[str] = Query(None, description="VD: -createdAt (dấu - là giảm dần)"),
+):
+    if db is None:
+        raise HTTPException(status_code=500, detail="MONGODB_URI is not configured")
+    return await list_documents(
+        request,
+        db.Order,
+        limit=limit,
+        after=after,
+        stream=stream,
+        fields=fields,
+        sort=sort,
+        allowed_fields=ORDER_FIELDS,
+        filters=ORDER_FILTERS,
+        indexes=ORDER_INDEXES,
+        version=order_version,
+        hedge=order_hedge,
+    )
+
+
+@router.get("/orders/count")
+async def count_order(request: Request):
+    if db is None:
+        raise HTTPException(status_code=500, detail="MONGODB_URI is not configured")
+    return await count_documents(request, db.Order, order_counts, ORDER_FILTERS, ORDER_INDEXES)
+
+
+@router.post("/orders:batchGet")
+async def batch_get_order(ids: List[str] = Body(..., embed=True)):
+    if db is None:
+        raise HTTPException(status_code=500, detail="MONGODB_URI is not configured")
+    return await batch_get(order_loader, ids)
+
+
+# Route /orders/{id} để cuối cùng: các route GET /orders/<tên> cố định phải khai báo phía trên
+@router.get("/orders/{order_id}")
+async def get_order_by_id(order_id: str):
     if db is None:
         raise HTTPException(status_code=500, detail="MONGODB_URI is not configured")
-    docs = await db.Order.find().to_list(length=None)
-    for d in docs:
-        if "_id" in d:
-            d["_id"] = str(d["_id"])  # serialize ObjectId
-    return docs
+    doc = await order_loader.load(parse_id(order_id))
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    return BSONJSONResponse(content=doc)
     
 
 # uvicorn main:app --reload --host 0.0.0.0 --port 8000
 
 # Prometheus metrics
 from fastapi.responses import Response
-from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import Counter, Histogram
+from exposition import CONTENT_TYPE_LATEST, metrics_exposition
 
 # Metrics definitions
 http_requests_total = Counter('http_requests_total', 'Total HTTP requests', ['method', 'endpoint', 'status'])
@@ -28,5 +157,5 @@ http_request_duration_seconds = Histogram('http_request_duration_seconds', 'HTTP
 @router.get("/metrics")
 async def metrics():
     """Prometheus metrics endpoint"""
-    data = generate_latest()
+    data = await metrics_exposition()
     return Response(content=data, media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,79 @@
+"""
+Hedged read: nếu read chưa xong sau ngưỡng (p95 hiện tại của command), gửi thêm một read
+tới member khác (read preference thay thế), lấy kết quả về trước và huỷ cái còn lại
+"""
+
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Optional
+
+from prometheus_client import Counter
+
+from monitoring import command_latency
+
+# Ngưỡng khi chưa đủ mẫu latency, và giới hạn dưới/trên cho ngưỡng thích ứng (ms)
+HEDGE_DEFAULT_DELAY_MS = float(os.getenv("MONGODB_HEDGE_DEFAULT_DELAY_MS", "50"))
+HEDGE_MIN_DELAY_MS = float(os.getenv("MONGODB_HEDGE_MIN_DELAY_MS", "5"))
+HEDGE_MAX_DELAY_MS = float(os.getenv("MONGODB_HEDGE_MAX_DELAY_MS", "1000"))
+
+mongodb_hedge_eligible_reads_total = Counter(
+    'mongodb_hedge_eligible_reads_total', 'Reads that could be hedged', ['collection']
+)
+mongodb_hedged_reads_total = Counter(
+    'mongodb_hedged_reads_total', 'Reads for which a hedge request was sent', ['collection']
+)
+mongodb_hedged_read_wins_total = Counter(
+    'mongodb_hedged_read_wins_total', 'Hedged reads by which request answered first', ['collection', 'winner']
+)
+
+
+def hedge_delay(collection: str, command: str = "find") -> float:
+    """Seconds to wait before hedging: the current p95 of `command` on `collection`, clamped"""
+    p95 = command_latency.quantile(collection, command)
+    delay_ms = HEDGE_DEFAULT_DELAY_MS if p95 is None else p95 * 1000
+    return min(max(delay_ms, HEDGE_MIN_DELAY_MS), HEDGE_MAX_DELAY_MS) / 1000
+
+
+async def hedged_read(
+    read: Callable[[Any], Awaitable[Any]],
+    collection,
+    hedge_collection: Optional[Any] = None,
+    command: str = "find",
+) -> Any:
+    """
+    Run `read(collection)`; if it is still pending after hedge_delay(), also run
+    `read(hedge_collection)` and return whichever succeeds first.
+
+    The loser is cancelled. Motor cannot abort a command already sent, so the
+    server finishes it, but its connection goes back to the pool unused.
+    Without a `hedge_collection` this is a plain read.
+    """
+    if hedge_collection is None:
+        return await read(collection)
+
+    name = collection.name
+    mongodb_hedge_eligible_reads_total.labels(collection=name).inc()
+    first = asyncio.ensure_future(read(collection))
+    pending = {first}
+    try:
+        done, pending = await asyncio.wait(pending, timeout=hedge_delay(name, command))
+        if done:
+            return first.result()
+
+        mongodb_hedged_reads_total.labels(collection=name).inc()
+        second = asyncio.ensure_future(read(hedge_collection))
+        pending = {first, second}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    winner = "hedge" if task is second else "original"
+                    mongodb_hedged_read_wins_total.labels(collection=name, winner=winner).inc()
+                    return task.result()
+                error = error or task.exception()
+        raise error
+    finally:
+        # Huỷ read còn lại (kể cả khi chính request bị huỷ)
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,342 @@
+"""
+Helpers dùng chung cho các list endpoint (keyset pagination, NDJSON streaming, field projection)
+"""
+
+import base64
+import binascii
+import os
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Mapping, Optional, Tuple
+
+from bson import Timestamp, json_util
+from bson.errors import BSONError
+from fastapi import HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+from pymongo import IndexModel, ReadPreference
+
+from cache import SingleFlight, cache_key
+from counting import CountCache
+from hedging import hedged_read
+from changes import CollectionVersion, etag_matches, make_etag
+from deadline import use_shared_deadline, with_deadline
+from loader import BatchLoader, parse_id
+from querying import PLAN_COLLSCAN, SortSpec, check_plan, parse_filters, parse_sort, plan_query, tiebreak
+from serialization import BSONJSONResponse, dumps
+
+# Giới hạn kích thước trang (có thể cấu hình qua biến môi trường)
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "50"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "500"))
+# Số document lấy mỗi lần từ Mongo khi stream
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "500"))
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# Các request list giống hệt nhau (cùng normalized params) đang chạy chỉ tạo một query Mongo
+_inflight = SingleFlight("list")
+
+
+def clamp_limit(limit: Optional[int]) -> int:
+    """Apply the default page size and the hard server-side maximum"""
+    if not limit or limit < 1:
+        return DEFAULT_PAGE_SIZE
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def encode_cursor(position: Dict[str, Any]) -> str:
+    """Encode the last-seen position as an opaque, URL-safe token"""
+    raw = json_util.dumps(position, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_cursor(token: str) -> Dict[str, Any]:
+    """Decode a token produced by encode_cursor, raising 400 on garbage"""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        position = json_util.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, ValueError, BSONError):
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+    if not isinstance(position, dict) or "_id" not in position:
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+    return position
+
+
+def parse_projection(fields: Optional[str], allowed: Iterable[str]) -> Optional[Dict[str, int]]:
+    """
+    Turn `fields=a,b,c` into a Mongo projection, checked against `allowed`.
+
+    Returns None when no fields were requested (full documents). `_id` is
+    always kept because pagination cursors are built from it.
+    """
+    if not fields:
+        return None
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = sorted(set(requested) - set(allowed) - {"_id"})
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    projection = {f: 1 for f in requested}
+    projection["_id"] = 1
+    return projection
+
+
+def _after(field: str, direction: int, value: Any) -> Optional[Dict[str, Any]]:
+    """`field` strictly after `value` in sort order; None if nothing can be"""
+    # $gt/$lt không so sánh khác kiểu BSON: null/thiếu field (nhỏ nhất khi sort) phải xử lý riêng
+    if value is None:
+        return {field: {"$ne": None}} if direction == 1 else None
+    if direction == 1:
+        return {field: {"$gt": value}}
+    return {"$or": [{field: {"$lt": value}}, {field: None}]}
+
+
+def _keyset(order: SortSpec, values: List[Any]) -> Dict[str, Any]:
+    """Build the "strictly after `values` in `order`" predicate"""
+    clauses = []
+    for i, (field, direction) in enumerate(order):
+        after = _after(field, direction, values[i])
+        if after is None:
+            continue
+        # {field: None} khớp cả null lẫn thiếu field, đúng như hai giá trị bằng nhau khi sort
+        clause = {f: v for (f, _), v in zip(order[:i], values[:i])}
+        clauses.append({**clause, **after})
+    return clauses[0] if len(clauses) == 1 else {"$or": clauses}
+
+
+def _build_find(
+    query: Optional[Dict[str, Any]],
+    sort: Optional[SortSpec],
+    after: Optional[str],
+) -> Tuple[Dict[str, Any], SortSpec]:
+    order = tiebreak(sort or [])
+    query = dict(query or {})
+    if after:
+        position = decode_cursor(after)
+        if order == [("_id", 1)]:
+            if "s" in position:
+                raise HTTPException(status_code=400, detail="Cursor does not match the requested sort")
+            values = [position["_id"]]
+        else:
+            keys = position.get("k")
+            if [list(k) for k in order] != position.get("s") or not isinstance(keys, list) or len(keys) != len(order) - 1:
+                raise HTTPException(status_code=400, detail="Cursor does not match the requested sort")
+            values = keys + [position["_id"]]
+        keyset = _keyset(order, values)
+        query = {"$and": [query, keyset]} if query else keyset
+    return query, order
+
+
+def _cursor_for(doc: Dict[str, Any], order: SortSpec) -> str:
+    position: Dict[str, Any] = {"_id": doc["_id"]}
+    if order != [("_id", 1)]:
+        position["k"] = [doc.get(f) for f, _ in order[:-1]]
+        position["s"] = [list(k) for k in order]
+    return encode_cursor(position)
+
+
+async def fetch_page(
+    collection,
+    limit: Optional[int] = None,
+    after: Optional[str] = None,
+    projection: Optional[Dict[str, int]] = None,
+    query: Optional[Dict[str, Any]] = None,
+    sort: Optional[SortSpec] = None,
+    hedge_collection=None,
+    after_cluster_time: Optional[Timestamp] = None,
+) -> Dict[str, Any]:
+    """
+    Read one page of `collection` matching `query`, ordered by `sort` then _id.
+
+    Uses a keyset predicate (position > last seen) instead of skip, so every
+    page is a bounded range scan on the index serving the sort. Fetches one
+    extra document to know whether a next page exists. With a
+    `hedge_collection` the read is hedged (see hedging.hedged_read). With
+    `after_cluster_time` the read is causally consistent: a secondary waits
+    until it has applied everything up to that cluster time.
+    """
+    limit = clamp_limit(limit)
+    query, order = _build_find(query, sort, after)
+
+    # Sort fields phải có trong kết quả để dựng cursor, bỏ đi nếu client không yêu cầu
+    hidden = []
+    if projection is not None:
+        hidden = [f for f, _ in order if f not in projection]
+        projection = {**projection, **{f: 1 for f in hidden}}
+
+    async def read(c, session=None):
+        if after_cluster_time is not None and session is None:
+            # Mỗi read một session (read hedge chạy song song với read gốc)
+            async with await c.database.client.start_session(causal_consistency=True) as session:
+                session.advance_operation_time(after_cluster_time)
+                return await read(c, session)
+        cursor = c.find(query, projection, session=session).sort(order).limit(limit + 1)
+        return await with_deadline(cursor).to_list(length=limit + 1)
+
+    docs = await hedged_read(read, collection, hedge_collection)
+
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = _cursor_for(docs[-1], order)
+
+    if hidden:
+        for d in docs:
+            for f in hidden:
+                d.pop(f, None)
+    return {"items": docs, "next": next_cursor}
+
+
+def on_primary(collection):
+    """`collection` reading from the primary (returned as is if it already does)"""
+    if collection.read_preference.mode == ReadPreference.PRIMARY.mode:
+        return collection
+    return collection.with_options(read_preference=ReadPreference.PRIMARY)
+
+
+def wants_stream(request: Request, stream: bool = False) -> bool:
+    """True if the client asked for NDJSON via `stream=true` or the Accept header"""
+    return stream or NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+async def _iter_ndjson(cursor, batch_size: int) -> AsyncIterator[bytes]:
+    lines = []
+    async for doc in cursor:
+        lines.append(dumps(doc))
+        if len(lines) >= batch_size:
+            yield b"\n".join(lines) + b"\n"
+            lines = []
+    if lines:
+        yield b"\n".join(lines) + b"\n"
+
+
+def stream_documents(
+    collection,
+    after: Optional[str] = None,
+    projection: Optional[Dict[str, int]] = None,
+    query: Optional[Dict[str, Any]] = None,
+    sort: Optional[SortSpec] = None,
+    batch_size: int = STREAM_BATCH_SIZE,
+) -> StreamingResponse:
+    """
+    Stream documents matching `query` as NDJSON, one per line, in `sort` order.
+
+    The Motor cursor is consumed batch by batch and each batch is written out
+    as one chunk, so memory stays bounded by `batch_size` whatever the
+    collection size. `after` resumes an export from a pagination cursor.
+    """
+    query, order = _build_find(query, sort, after)
+    # Không gắn maxTimeMS: export chạy lâu hơn deadline của request (deadline dừng khi response bắt đầu)
+    cursor = collection.find(query, projection).sort(order).batch_size(batch_size)
+    return StreamingResponse(_iter_ndjson(cursor, batch_size), media_type=NDJSON_MEDIA_TYPE)
+
+
+async def list_documents(
+    request: Request,
+    collection,
+    *,
+    limit: Optional[int],
+    after: Optional[str],
+    stream: bool,
+    fields: Optional[str],
+    sort: Optional[str],
+    allowed_fields: Iterable[str],
+    filters: Mapping[str, Callable[[str], Any]],
+    indexes: Iterable[IndexModel],
+    cache=None,
+    version: Optional[CollectionVersion] = None,
+    hedge=None,
+):
+    """
+    Shared implementation of the entity list endpoints.
+
+    Parses projection, filters and sort from the request, checks the query
+    against the service's declared indexes, then returns either a page or an
+    NDJSON stream. Pages are serialized once and served from `cache` (a
+    ResponseCache or SharedResponseCache) when one is given, and identical
+    concurrent misses share one query. With a
+    `version`, pages carry a strong ETag and a matching If-None-Match gets
+    304 before any document is read. `hedge` is the collection handle used
+    for hedged page reads (None disables hedging).
+
+    The version and the cache invalidation follow `version`'s change stream,
+    so pages that are cached or carry an ETag are read after the cluster time
+    that stream has reached: a lagging secondary waits until it has applied
+    every change already seen, instead of serving an older body under the
+    new version. The hedge read waits for the same cluster time, so hedged
+    pages stay consistent too. Without that cluster time (stream down, or no
+    `version`) those pages are read from the primary, unhedged.
+    """
+    projection = parse_projection(fields, allowed_fields)
+    query = parse_filters(request.query_params, filters)
+    sort_spec = parse_sort(sort, allowed_fields)
+    check_plan(query, sort_spec, indexes)
+    if wants_stream(request, stream):
+        return stream_documents(collection, after=after, projection=projection, query=query, sort=sort_spec)
+
+    cluster_time = version.watcher.operation_time if version is not None else None
+    if (cache is not None or version is not None) and cluster_time is None:
+        collection, hedge = on_primary(collection), None
+
+    key = cache_key(request)
+    headers = {}
+    if version is not None:
+        # Đọc version trước khi query: nếu dữ liệu đổi giữa chừng, ETag cũ sẽ không khớp lần sau
+        etag = make_etag(await version.token(collection), key)
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+
+    body = cache.get(key) if cache is not None else None
+    if body is None:
+
+        async def load() -> bytes:
+            # Chạy trong task riêng của singleflight, dùng chung cho mọi request gộp vào (và cho cache):
+            # không kế thừa deadline (có thể rất ngắn) của request khởi tạo
+            use_shared_deadline()
+            # Serialize một lần: các request gộp chung và cache dùng lại đúng bytes này
+            page = await fetch_page(
+                collection,
+                limit=limit,
+                after=after,
+                projection=projection,
+                query=query,
+                sort=sort_spec,
+                hedge_collection=hedge,
+                after_cluster_time=cluster_time,
+            )
+            return dumps(page)
+
+        if cache is not None:
+            generation = cache.generation
+            body = await _inflight.do(key, lambda: cache.fill(key, load, generation))
+        else:
+            body = await _inflight.do(key, load)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+async def batch_get(loader: BatchLoader, ids: List[str]) -> BSONJSONResponse:
+    """Shared implementation of `POST /<entity>:batchGet`: documents in request order plus missing ids"""
+    if len(ids) > MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_PAGE_SIZE} ids per request")
+    docs = await loader.load_many(parse_id(i) for i in ids)
+    return BSONJSONResponse(content={
+        "items": [d for d in docs if d is not None],
+        "missing": [i for i, d in zip(ids, docs) if d is None],
+    })
+
+
+async def count_documents(
+    request: Request,
+    collection,
+    counter: CountCache,
+    filters: Mapping[str, Callable[[str], Any]],
+    indexes: Iterable[IndexModel],
+) -> BSONJSONResponse:
+    """
+    Shared implementation of `GET /<entity>/count`.
+
+    Unfiltered counts come from collection metadata (`estimated: true`).
+    Filtered counts must be served by an index and are cached by `counter`.
+    """
+    query = parse_filters(request.query_params, filters)
+    if query and plan_query(query, [], indexes) == PLAN_COLLSCAN:
+        raise HTTPException(status_code=400, detail="Counting by these filters is not supported by any index")
+    value, computed_at = await counter.count(collection, query)
+    return BSONJSONResponse(content={"count": value, "estimated": not query, "computedAt": computed_at})
@@ -1,15 +1,10 @@
-from fastapi import FastAPI, Request
-from routes import router
-from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
-import time
-
-# Prometheus metrics (service-scoped names to avoid duplicates)
-template_http_requests_total = Counter(
-    'template_http_requests_total', 'Total HTTP requests (template)', ['method', 'endpoint', 'status']
-)
-template_http_request_duration_seconds = Histogram(
-    'template_http_request_duration_seconds', 'HTTP request duration (template)', ['method', 'endpoint']
-)
+from fastapi import FastAPI
+from routes import ROUTE_DEADLINES_MS, router
+from compression import CompressionMiddleware
+from deadline import DeadlineMiddleware
+from middleware import MetricsMiddleware
+from loopmonitor import install_loop_monitor
+from exposition import CONTENT_TYPE_LATEST, metrics_exposition
 
 # Tạo FastAPI app
 app = FastAPI(
@@ -18,27 +13,15 @@ app = FastAPI(
     version="1.0.0"
 )
 
-# Middleware để track HTTP requests
-@app.middleware("http")
-async def track_requests(request: Request, call_next):
-    start_time = time.time()
-    
-    # Process request
-    response = await call_next(request)
-    
-    # Calculate duration
-    duration = time.time() - start_time
-    
-    # Extract metrics
-    method = request.method
-    endpoint = request.url.path
-    status = str(response.status_code)
-    
-    # Update metrics
-    template_http_requests_total.labels(method=method, endpoint=endpoint, status=status).inc()
-    template_http_request_duration_seconds.labels(method=method, endpoint=endpoint).observe(duration)
-    
-    return response
+# Nén response (zstd/br/gzip theo Accept-Encoding), bỏ qua body nhỏ
+app.add_middleware(CompressionMiddleware)
+# Deadline cho từng request: quá hạn thì huỷ handler (kèm query Mongo) và trả 504
+app.add_middleware(DeadlineMiddleware, routes=ROUTE_DEADLINES_MS)
+
+# Đếm và đo thời gian request theo route template (ngoài cùng: tính cả nén và 504 do deadline)
+app.add_middleware(MetricsMiddleware, prefix="template")
+# Đo độ trễ event loop, ghi log stack khi một callback chặn loop quá ngưỡng
+install_loop_monitor(app)
 
 # Đăng ký routes KHÔNG cần API key
 app.include_router(router)
@@ -51,7 +34,7 @@ async def health_check():
 async def metrics():
     """Prometheus metrics endpoint - không yêu cầu API key"""
     from fastapi import Response
-    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+    return Response(await metrics_exposition(), media_type=CONTENT_TYPE_LATEST)
 
 if __name__ == "__main__":
     import uvicorn
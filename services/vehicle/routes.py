@@ -1,25 +1,162 @@
-from fastapi import APIRouter, HTTPException
-from db import db
+import asyncio
+from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Request, Body, Query
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from db import REFERENCE_MAX_STALENESS_SECONDS, REFERENCE_READ_PREFERENCE, db, hedge_reader, reader
+from changes import CollectionVersion, CollectionWatcher
+from counting import CountCache
+from indexes import ensure_indexes
+from listing import DEFAULT_PAGE_SIZE, batch_get, count_documents, list_documents
+from loader import BatchLoader, parse_id
+from sharedcache import open_response_cache
+from serialization import BSONJSONResponse
 
 router = APIRouter()
 
+# Các field client được phép chọn qua ?fields= (projection đẩy xuống Mongo)
+VEHICLE_FIELDS = {
+    "vehicleId",
+    "plateNumber",
+    "type",
+    "capacity",
+    "status",
+    "driverId",
+    "createdAt",
+    "updatedAt",
+}
+
+# Field được phép filter (?field=value hoặc ?field=a,b) và hàm chuyển kiểu giá trị
+VEHICLE_FILTERS = {
+    "vehicleId": str,
+    "plateNumber": str,
+    "status": str,
+    "type": str,
+    "driverId": str,
+}
+
+# Index khai báo cho collection: được tạo lúc startup (indexes.ensure_indexes) và query planner
+# dựa vào đây để từ chối query quét toàn bộ collection. TTL: IndexModel(..., expireAfterSeconds=N)
+VEHICLE_INDEXES = [
+    IndexModel([("vehicleId", ASCENDING)], unique=True),
+    # Field không bắt buộc: unique chỉ áp dụng cho document có giá trị (thiếu/null thì không vào index)
+    IndexModel([("plateNumber", ASCENDING)], unique=True, partialFilterExpression={"plateNumber": {"$type": "string"}}),
+    IndexModel([("status", ASCENDING), ("_id", ASCENDING)]),
+    IndexModel([("type", ASCENDING), ("_id", ASCENDING)]),
+    IndexModel([("driverId", ASCENDING), ("_id", ASCENDING)]),
+    IndexModel([("updatedAt", DESCENDING)]),
+]
+
+# (collection, index spec) của service, dùng cho startup và `python indexes.py`
+INDEX_SPECS = [("Vehicle", VEHICLE_INDEXES)]
+
+# Deadline (ms) riêng cho từng route (theo path template); route khác dùng REQUEST_DEADLINE_MS
+ROUTE_DEADLINES_MS = {
+    "/vehicle/{vehicle_id}": 2000,
+    "/vehicle:batchGet": 3000,
+    "/vehicle/count": 3000,
+}
+
+# Dữ liệu tham chiếu chấp nhận trễ nhẹ: đọc theo read preference riêng (trang list có cache/ETag
+# vẫn chờ secondary theo kịp change stream trước khi đọc, xem list_documents)
+vehicle_reads = reader("Vehicle", REFERENCE_READ_PREFERENCE, REFERENCE_MAX_STALENESS_SECONDS)
+# Collection dùng cho hedged read (None nếu MONGODB_HEDGED_READS tắt)
+vehicle_hedge = hedge_reader("Vehicle", REFERENCE_READ_PREFERENCE)
+
+# Change stream của collection: invalidate cache, cập nhật version token cho ETag và làm mới count
+vehicle_watcher = CollectionWatcher("vehicle")
+vehicle_version = CollectionVersion(vehicle_watcher)
+vehicle_counts = CountCache("vehicle", vehicle_watcher)
+
+# Dữ liệu tham chiếu, đọc nhiều: cache response (dùng chung giữa các worker nếu RESPONSE_CACHE_SHARED)
+vehicle_cache = open_response_cache("vehicle")
+vehicle_watcher.subscribe(vehicle_cache.on_change)
+
+# Gộp các lookup theo id đồng thời thành một query $in
+vehicle_loader = BatchLoader("vehicle", vehicle_reads, hedge_collection=vehicle_hedge) if db is not None else None
+
+_index_task: Optional[asyncio.Future] = None
+
+
+@router.on_event("startup")
+async def _start_change_watcher():
+    if db is not None:
+        vehicle_watcher.start(db.Vehicle)
+        vehicle_counts.start(vehicle_reads)
+
+
+@router.on_event("startup")
+async def _ensure_indexes():
+    global _index_task
+    if db is not None:
+        # Chạy nền để việc build index trên collection lớn không chặn readiness
+        _index_task = asyncio.gather(*(ensure_indexes(db[name], spec) for name, spec in INDEX_SPECS))
+
+
+@router.on_event("shutdown")
+async def _stop_change_watcher():
+    await vehicle_watcher.stop()
+    await vehicle_counts.stop()
+
 
 @router.get("/vehicle")
-async def get_Vehicles():
+async def get_Vehicles(
+    request: Request,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1),
+    after: Optional[str] = Query(None, description="Cursor `next` của trang trước"),
+    stream: bool = Query(False, description="Trả về NDJSON stream toàn bộ collection"),
+    fields: Optional[str] = Query(None, description="Danh sách field, phân cách bằng dấu phẩy"),
+    sort: Optional[str] = Query(None, description="VD: -createdAt (dấu - là giảm dần)"),
+):
+    if db is None:
+        raise HTTPException(status_code=500, detail="MONGODB_URI is not configured")
+    return await list_documents(
+        request,
+        vehicle_reads,
+        limit=limit,
+        after=after,
+        stream=stream,
+        fields=fields,
+        sort=sort,
+        allowed_fields=VEHICLE_FIELDS,
+        filters=VEHICLE_FILTERS,
+        indexes=VEHICLE_INDEXES,
+        cache=vehicle_cache,
+        version=vehicle_version,
+        hedge=vehicle_hedge,
+    )
+
+
+@router.get("/vehicle/count")
+async def count_vehicle(request: Request):
+    if db is None:
+        raise HTTPException(status_code=500, detail="MONGODB_URI is not configured")
+    return await count_documents(request, vehicle_reads, vehicle_counts, VEHICLE_FILTERS, VEHICLE_INDEXES)
+
+
+@router.post("/vehicle:batchGet")
+async def batch_get_vehicle(ids: List[str] = Body(..., embed=True)):
+    if db is None:
+        raise HTTPException(status_code=500, detail="MONGODB_URI is not configured")
+    return await batch_get(vehicle_loader, ids)
+
+
+# Route /vehicle/{id} để cuối cùng: các route GET /vehicle/<tên> cố định phải khai báo phía trên
+@router.get("/vehicle/{vehicle_id}")
+async def get_vehicle_by_id(vehicle_id: str):
     if db is None:
         raise HTTPException(status_code=500, detail="MONGODB_URI is not configured")
-    docs = await db.Vehicle.find().to_list(length=None)
-    for d in docs:
-        if "_id" in d:
-            d["_id"] = str(d["_id"])  # serialize ObjectId
-    return docs
+    doc = await vehicle_loader.load(parse_id(vehicle_id))
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Vehicle not found")
+    return BSONJSONResponse(content=doc)
     
 
 # uvicorn main:app --reload --host 0.0.0.0 --port 8000
 
 # Prometheus metrics
 from fastapi.responses import Response
-from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import Counter, Histogram
+from exposition import CONTENT_TYPE_LATEST, metrics_exposition
 
 # Metrics definitions
 http_requests_total = Counter('http_requests_total', 'Total HTTP requests', ['method', 'endpoint', 'status'])
@@ -28,5 +165,5 @@ http_request_duration_seconds = Histogram('http_request_duration_seconds', 'HTTP
 @router.get("/metrics")
 async def metrics():
     """Prometheus metrics endpoint"""
-    data = generate_latest()
+    data = await metrics_exposition()
     return Response(content=data, media_type=CONTENT_TYPE_LATEST)